@@ -1,24 +1,31 @@
 import os
+import io
+import sys
+import json
 import uuid
+import gc
+import time
+import stat
 import shutil
+import heapq
+import hashlib
+import mimetypes
 import zipfile # Added for zipping images from PDF
-from flask import Flask, render_template, request, redirect, url_for, send_from_directory, flash, jsonify
+import importlib
+import threading
+import functools
+import multiprocessing
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import quote
+from concurrent.futures import CancelledError, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from flask import Flask, Response, g, has_request_context, render_template, request, redirect, url_for, send_file, flash, jsonify, stream_with_context
 from werkzeug.utils import secure_filename
-from PIL import Image
-
-# Core Conversion/Merging Libraries
-from PyPDF2 import PdfReader, PdfWriter, PdfMerger # PyPDF2 3.0+
-from docx import Document as DocxDocument
-from pptx import Presentation
-from docx2pdf import convert as docx2pdf_convert
-from pdf2image import convert_from_path as pdf_to_images_convert # Needs poppler
-from pdf2docx import Converter as Pdf2DocxConverter
-import img2pdf
-
-from reportlab.pdfgen import canvas as reportlab_canvas
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.utils import ImageReader as ReportlabImageReader
 
+# Conversion/merging backends (PyPDF2, python-docx, python-pptx, docx2pdf, pdf2image, pdf2docx,
+# img2pdf, reportlab, Pillow) are imported inside the functions that use them, on first use.
+# See the converter registry below for the backend list and FILEPRO_PREWARM.
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", "a_very_strong_default_secret_key_that_should_be_changed_for_prod")
@@ -34,8 +41,8 @@ app.config['MAX_CONTENT_LENGTH'] = 32 * 1024 * 1024
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(CONVERTED_FOLDER, exist_ok=True)
 
-ALLOWED_UPLOAD_EXTENSIONS = {'pdf', 'docx', 'pptx', 'jpg', 'jpeg', 'png'}
-IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png'}
+ALLOWED_UPLOAD_EXTENSIONS = {'pdf', 'docx', 'pptx', 'jpg', 'jpeg', 'png', 'webp'}
+IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png', 'webp'}
 
 def get_file_ext(filename): # Same helper
     return filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
@@ -54,18 +61,165 @@ def cleanup_files(*filepaths): # Same helper
                 app.logger.error(f"Error cleaning up file/folder {filepath}: {e}")
 
 
-# --- Conversion Functions (These should be the robust versions from previous enhanced prompt) ---
-def convert_pdf_to_docx_robust(input_path, output_path): # Same
+# --- Metrics ---
+# Minimal Prometheus-style registry, rendered in text exposition format at /metrics.
+# In job pool workers, updates are forwarded to the web process over the worker event queue
+# (see the job queue section), so a web process's scrape covers the conversions of its own job pool.
+# The registry is not shared between web processes: each scrape reaches one of them, so every
+# series carries a pid label and stays monotonic on its own; aggregate with sum without (pid).
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+app.config['TRACE_REQUESTS'] = os.environ.get("FILEPRO_TRACE_REQUESTS", "0").lower() in ('1', 'true', 'yes')
+
+_worker_event_queue = None # Set in job pool workers, see _init_job_worker
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {} # name -> (type, help, buckets)
+        self._values = {} # name -> {sorted label items: value, or [bucket counts, sum, count] for histograms}
+
+    def describe(self, name, metric_type, help_text, buckets=None):
+        self._meta[name] = (metric_type, help_text, buckets)
+        self._values.setdefault(name, {})
+
+    def inc(self, name, value=1, **labels): # Counters, and relative gauge changes
+        self._record('inc', name, value, labels)
+
+    def set(self, name, value, **labels):
+        self._record('set', name, value, labels)
+
+    def observe(self, name, value, **labels):
+        self._record('observe', name, value, labels)
+
+    def _record(self, op, name, value, labels):
+        if _worker_event_queue is not None: # Inside a pool worker: let the web process apply it
+            try:
+                _worker_event_queue.put_nowait(('metric', (op, name, value, labels)))
+            except Exception:
+                pass # Metrics are best effort
+            return
+        self.apply(op, name, value, labels)
+
+    def apply(self, op, name, value, labels):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self._values.setdefault(name, {})
+            if op == 'inc':
+                series[key] = series.get(key, 0) + value
+            elif op == 'set':
+                series[key] = value
+            else:
+                buckets = self._meta[name][2]
+                state = series.setdefault(key, [[0] * len(buckets), 0.0, 0])
+                for index, bound in enumerate(buckets):
+                    if value <= bound:
+                        state[0][index] += 1
+                state[1] += value
+                state[2] += 1
+
+    def render(self):
+        process_label = (('pid', str(os.getpid())),)
+        def label_text(items):
+            items = process_label + items
+            return '{' + ','.join(f'{k}="{v}"' for k, v in items) + '}'
+        lines = []
+        with self._lock:
+            for name, (metric_type, help_text, buckets) in self._meta.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for key, value in self._values.get(name, {}).items():
+                    if metric_type != 'histogram':
+                        lines.append(f"{name}{label_text(key)} {value}")
+                        continue
+                    counts, total, count = value
+                    for bound, bucket_count in zip(buckets, counts):
+                        lines.append(f"{name}_bucket{label_text(key + (('le', str(bound)),))} {bucket_count}")
+                    lines.append(f"{name}_bucket{label_text(key + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{name}_sum{label_text(key)} {total}")
+                    lines.append(f"{name}_count{label_text(key)} {count}")
+        return '\n'.join(lines) + '\n'
+
+metrics = MetricsRegistry()
+metrics.describe('filepro_http_request_duration_seconds', 'histogram', "HTTP request latency by endpoint and status.", LATENCY_BUCKETS)
+metrics.describe('filepro_http_requests_in_flight', 'gauge', "HTTP requests currently being handled, by endpoint.")
+metrics.describe('filepro_stage_duration_seconds', 'histogram', "Time spent in each stage of a route or job.", LATENCY_BUCKETS)
+metrics.describe('filepro_conversion_duration_seconds', 'histogram', "End-to-end conversion/merge latency by format pair.", LATENCY_BUCKETS)
+metrics.describe('filepro_conversions_total', 'counter', "Conversions and merges by format pair and outcome.")
+metrics.describe('filepro_bytes_in_total', 'counter', "Input bytes handed to converters, by format pair.")
+metrics.describe('filepro_bytes_out_total', 'counter', "Output bytes produced by converters, by format pair.")
+metrics.describe('filepro_converter_duration_seconds', 'histogram', "Time spent inside each converter function.", LATENCY_BUCKETS)
+metrics.describe('filepro_converter_runs_total', 'counter', "Converter function calls by outcome.")
+metrics.describe('filepro_converter_in_flight', 'gauge', "Converter function calls currently running.")
+metrics.describe('filepro_pages_processed_total', 'counter', "Pages, slides or images processed, by converter.")
+metrics.describe('filepro_jobs', 'gauge', "Background jobs currently tracked, by status.")
+metrics.describe('filepro_result_cache', 'gauge', "Conversion result cache statistics.")
+metrics.describe('filepro_storage', 'gauge', "Storage janitor statistics.")
+
+@contextmanager
+def track_stage(stage):
+    # Times a block into filepro_stage_duration_seconds (and the request trace, when tracing is on).
+    started = time.perf_counter()
     try:
-        cv = Pdf2DocxConverter(input_path)
-        cv.convert(output_path)
-        cv.close()
-        return True, "PDF converted to DOCX successfully."
-    except Exception as e:
-        app.logger.error(f"pdf2docx conversion error: {e}", exc_info=True)
-        return False, f"PDF to DOCX conversion failed. Error: {str(e)}. Complex PDFs may not convert well."
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        route = request.endpoint if has_request_context() else 'worker'
+        metrics.observe('filepro_stage_duration_seconds', elapsed, route=route, stage=stage)
+        if has_request_context() and g.get('trace_stages') is not None:
+            g.trace_stages.append((stage, elapsed))
+
+def timed_converter(name):
+    # Decorator for converter/merge functions that return (success, message, ...).
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            metrics.inc('filepro_converter_in_flight', 1, converter=name)
+            started = time.perf_counter()
+            outcome = 'error'
+            try:
+                result = func(*args, **kwargs)
+                outcome = 'success' if result[0] else 'failure'
+                return result
+            finally:
+                metrics.inc('filepro_converter_in_flight', -1, converter=name)
+                metrics.observe('filepro_converter_duration_seconds', time.perf_counter() - started, converter=name)
+                metrics.inc('filepro_converter_runs_total', converter=name, outcome=outcome)
+        return wrapper
+    return decorator
+
+def _total_file_size(*paths):
+    return sum(os.path.getsize(p) for p in paths if p and os.path.isfile(p))
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.trace_stages = [] if app.config['TRACE_REQUESTS'] or request.headers.get('X-FilePro-Trace') == '1' else None
+    metrics.inc('filepro_http_requests_in_flight', 1, endpoint=request.endpoint or 'unknown')
+
+@app.after_request
+def finish_request_metrics(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    endpoint = request.endpoint or 'unknown'
+    metrics.inc('filepro_http_requests_in_flight', -1, endpoint=endpoint)
+    if endpoint != 'metrics_route':
+        metrics.observe('filepro_http_request_duration_seconds', elapsed, endpoint=endpoint, status=response.status_code)
+    stages = g.get('trace_stages')
+    if stages is not None:
+        # For streamed responses this covers the work up to the first byte
+        timings = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in stages] + [f"total;dur={elapsed * 1000:.1f}"]
+        response.headers['Server-Timing'] = ', '.join(timings)
+        app.logger.info(f"trace {request.method} {request.path} -> {response.status_code} in {elapsed:.3f}s: "
+                        + ', '.join(f"{stage}={seconds:.3f}s" for stage, seconds in stages))
+    return response
+
 
+# --- Conversion Functions (These should be the robust versions from previous enhanced prompt) ---
+@timed_converter('docx_to_pdf')
 def convert_docx_to_pdf_robust(input_path, output_path): # Same
+    from docx2pdf import convert as docx2pdf_convert
     try:
         docx2pdf_convert(input_path, output_path)
         return True, "DOCX converted to PDF successfully."
@@ -73,123 +227,556 @@ def convert_docx_to_pdf_robust(input_path, output_path): # Same
         app.logger.error(f"docx2pdf conversion error: {e}", exc_info=True)
         return False, f"DOCX to PDF conversion failed. Ensure LibreOffice or MS Office is available. Error: {str(e)}"
 
-def convert_images_to_pdf_robust(image_paths, output_path): # Same
+# --- Image Pipeline ---
+# Images are handled one at a time, so at most one decoded bitmap is alive. When downscaling, the JPEG
+# decoder scales by 1/2-1/8 while decoding (draft mode) and the rest is box-reduced before resampling,
+# so a 100-megapixel scan is never decoded at full size just to be shrunk. Other formats have no
+# reduced decoding in Pillow and are decoded at full size, within FILEPRO_IMAGE_MAX_PIXELS.
+# Images that need no changes go into PDFs untouched (img2pdf embeds JPEGs without re-encoding).
+# img2pdf (like PdfWriter) holds every image it's given in memory until it writes, so for several images
+# each one becomes a one-page PDF in memory and _PdfPageStreamWriter copies that page's objects to the
+# output right away. Peak memory is set by the largest image, not by the number of images.
+app.config['IMAGE_MAX_PIXELS'] = int(os.environ.get("FILEPRO_IMAGE_MAX_PIXELS", 250_000_000)) # Refuse larger inputs (decompression bombs)
+app.config['IMAGE_DEFAULT_QUALITY'] = int(os.environ.get("FILEPRO_IMAGE_DEFAULT_QUALITY", 85)) # JPEG/WebP quality when re-encoding
+IMAGE_SAVE_FORMATS = {'jpg': 'JPEG', 'jpeg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP'}
+IMG2PDF_PASSTHROUGH_EXTENSIONS = {'jpg', 'jpeg', 'png'}
+
+def parse_image_options(form):
+    # Reads max_dimension (longest side in pixels) and quality (1-95, JPEG/WebP) from a request form.
+    # Raises ValueError on bad input.
+    max_dimension = _optional_positive_int(form, 'max_dimension')
+    quality = _optional_positive_int(form, 'quality')
+    if quality and quality > 95:
+        raise ValueError("'quality' must be between 1 and 95.")
+    return {'max_dimension': max_dimension, 'quality': quality}
+
+def open_image_reduced(input_path, max_dimension=None):
+    # Opens an image, downscaled so its longest side is at most max_dimension, and upright per EXIF.
+    from PIL import Image, ImageOps
+    Image.MAX_IMAGE_PIXELS = app.config['IMAGE_MAX_PIXELS'] // 2 # Pillow warns above this and only refuses above twice it
+    img = Image.open(input_path)
+    if max_dimension and max(img.size) > max_dimension:
+        scale = max_dimension / max(img.size)
+        target_size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        # JPEG only: decode at the smallest 1/2..1/8 scale that is still at least target_size
+        draft = img.draft(None, target_size)
+        resized = img.resize(target_size, Image.LANCZOS, box=draft[1] if draft else None, reducing_gap=2.0)
+        img.close()
+        img = resized
+    transposed = ImageOps.exif_transpose(img)
+    if transposed is not img:
+        img.close()
+    return transposed
+
+def save_image(img, output, target_ext, quality=None):
+    # output is a path or a binary stream. Alpha is flattened onto white for JPEG.
+    save_format = IMAGE_SAVE_FORMATS[target_ext]
+    if save_format == 'JPEG' and img.mode not in ('RGB', 'L', 'CMYK'):
+        from PIL import Image
+        rgba = img.convert('RGBA')
+        flattened = Image.new('RGB', rgba.size, (255, 255, 255))
+        flattened.paste(rgba, mask=rgba.getchannel('A'))
+        rgba.close()
+        img = flattened
+    params = {}
+    if save_format in ('JPEG', 'WEBP'):
+        params['quality'] = quality or app.config['IMAGE_DEFAULT_QUALITY']
+    if save_format == 'JPEG':
+        params['optimize'] = True
+    img.save(output, format=save_format, **params)
+
+@timed_converter('image_to_image')
+def convert_image_format(input_path, output_path, max_dimension=None, quality=None):
+    # Image to image (e.g. PNG to JPG or WebP); the target format comes from the output extension.
+    target_format = get_file_ext(output_path)
+    img = None
+    try:
+        img = open_image_reduced(input_path, max_dimension)
+        save_image(img, output_path, target_format, quality)
+        metrics.inc('filepro_pages_processed_total', converter='image_to_image')
+        return True, f"Image converted to .{target_format.upper()} successfully."
+    except Exception as img_e:
+        app.logger.error(f"Image to Image conversion error: {img_e}", exc_info=True)
+        return False, f"Image to {target_format.upper()} conversion failed: {str(img_e)}"
+    finally:
+        if img is not None:
+            img.close()
+
+class _PdfPageStreamWriter:
+    # Appends the pages of other PDFs to a binary stream object by object, renumbering references, and
+    # forgets them once written. Pages must not inherit attributes from their page tree or share
+    # objects with pages from other readers, which holds for img2pdf's one-image PDFs.
+    def __init__(self, stream):
+        self.stream = stream
+        self.offsets = [None] # By object number - 1. Object 1 is the page tree, written by close()
+        self.page_numbers = []
+        stream.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+
+    def _new_number(self):
+        self.offsets.append(None)
+        return len(self.offsets)
+
+    def _serialize(self, obj, numbers, pending):
+        from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject
+        if isinstance(obj, IndirectObject):
+            if (obj.idnum, obj.generation) not in numbers:
+                numbers[(obj.idnum, obj.generation)] = self._new_number()
+                pending.append((numbers[(obj.idnum, obj.generation)], obj.get_object()))
+            return b"%d 0 R" % numbers[(obj.idnum, obj.generation)]
+        if isinstance(obj, DictionaryObject):
+            return b"<<" + b"".join(self._serialize(key, numbers, pending) + b" " + self._serialize(value, numbers, pending)
+                                    for key, value in obj.items() if key not in ('/Parent', '/Length')) + b">>"
+        if isinstance(obj, ArrayObject):
+            return b"[" + b" ".join(self._serialize(item, numbers, pending) for item in obj) + b"]"
+        buffer = io.BytesIO()
+        obj.write_to_stream(buffer, None)
+        return buffer.getvalue()
+
+    def _write_object(self, number, body, stream_data=None):
+        self.offsets[number - 1] = self.stream.tell()
+        self.stream.write(b"%d 0 obj\n" % number)
+        if stream_data is None:
+            self.stream.write(body)
+        else: # Stream bodies are copied as they are, still encoded
+            self.stream.write(body[:-2] + b"/Length %d>>\nstream\n" % len(stream_data))
+            self.stream.write(stream_data)
+            self.stream.write(b"\nendstream")
+        self.stream.write(b"\nendobj\n")
+
+    def add_pages(self, reader):
+        from PyPDF2.generic import StreamObject
+        for page in reader.pages:
+            numbers, pending = {}, []
+            page_number = self._new_number()
+            self._write_object(page_number, self._serialize(page, numbers, pending)[:-2] + b"/Parent 1 0 R>>")
+            while pending:
+                number, obj = pending.pop()
+                self._write_object(number, self._serialize(obj, numbers, pending),
+                                   obj._data if isinstance(obj, StreamObject) else None)
+            self.page_numbers.append(page_number)
+
+    def close(self):
+        kids = b" ".join(b"%d 0 R" % number for number in self.page_numbers)
+        self._write_object(1, b"<</Type /Pages /Kids [%s] /Count %d>>" % (kids, len(self.page_numbers)))
+        catalog_number = self._new_number()
+        self._write_object(catalog_number, b"<</Type /Catalog /Pages 1 0 R>>")
+        xref_offset = self.stream.tell()
+        self.stream.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(self.offsets) + 1))
+        self.stream.write(b"".join(b"%010d 00000 n \n" % offset for offset in self.offsets))
+        self.stream.write(b"trailer\n<</Size %d /Root %d 0 R>>\nstartxref\n%d\n%%%%EOF\n"
+                          % (len(self.offsets) + 1, catalog_number, xref_offset))
+
+@timed_converter('images_to_pdf')
+def convert_images_to_pdf_robust(image_paths, output_path, max_dimension=None, quality=None):
+    # One page per image, in order. Images are only re-encoded (to JPEG, or PNG when they have
+    # transparency) when they have to be resized or recompressed, or img2pdf can't embed them as they are.
+    import img2pdf
+    from PyPDF2 import PdfReader
+    scratch_paths = []
     try:
         valid_image_paths = [p for p in image_paths if get_file_ext(os.path.basename(p)) in IMAGE_EXTENSIONS]
         if not valid_image_paths:
             return False, "No valid images provided for PDF conversion."
+        scratch_stem = os.path.join(app.config['UPLOAD_FOLDER'], f"img2pdf_part_{uuid.uuid4().hex}")
         with open(output_path, "wb") as f:
-            f.write(img2pdf.convert(valid_image_paths))
+            page_writer = _PdfPageStreamWriter(f) if len(valid_image_paths) > 1 else None
+            for index, image_path in enumerate(valid_image_paths):
+                page_path = image_path
+                if get_file_ext(image_path) not in IMG2PDF_PASSTHROUGH_EXTENSIONS or max_dimension or quality:
+                    img = open_image_reduced(image_path, max_dimension)
+                    try:
+                        has_alpha = img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+                        target_ext = 'png' if has_alpha else 'jpg'
+                        page_path = f"{scratch_stem}_{index}.{target_ext}"
+                        scratch_paths.append(page_path)
+                        save_image(img, page_path, target_ext, quality)
+                    finally:
+                        img.close()
+                if page_writer is None:
+                    img2pdf.convert(page_path, outputstream=f)
+                else:
+                    page_writer.add_pages(PdfReader(io.BytesIO(img2pdf.convert(page_path))))
+                    gc.collect() # PyPDF2's reader and pages reference each other, so the image would wait for a GC run
+                if page_path != image_path:
+                    cleanup_files(page_path)
+                report_job_progress(0.9 * (index + 1) / len(valid_image_paths), f"Added image {index + 1} of {len(valid_image_paths)}.")
+            if page_writer is not None:
+                page_writer.close()
+        metrics.inc('filepro_pages_processed_total', len(valid_image_paths), converter='images_to_pdf')
         return True, "Images converted to PDF successfully."
     except Exception as e:
         app.logger.error(f"Images to PDF conversion error: {e}", exc_info=True)
         return False, f"Failed to convert images to PDF. Error: {str(e)}"
+    finally:
+        cleanup_files(*scratch_paths)
 
-def convert_pdf_to_images_robust(input_path, output_folder_stem_for_naming): # Same, returns path to zip or single image
-    # output_folder_stem_for_naming is like "converted/uniqueid_output"
-    output_image_paths = []
-    temp_image_dir_name = f"{os.path.basename(output_folder_stem_for_naming)}_img_pages_{uuid.uuid4().hex[:4]}"
-    temp_image_dir_path = os.path.join(app.config['CONVERTED_FOLDER'], temp_image_dir_name) # Create temp dir inside converted
+# --- PDF -> DOCX (page ranges, parallel parsing) ---
+# Only the selected pages are parsed. Large selections are split into segments parsed on a process
+# pool; each segment's pages are serialized to JSON with pdf2docx's own store/restore and the DOCX
+# is assembled in this process. pdf2docx's built-in multi_processing isn't used: it writes its
+# JSON into the working directory and can't report progress. Small selections are parsed one page
+# at a time in-process so progress still moves page by page.
+app.config['PDF2DOCX_WORKERS'] = int(os.environ.get("FILEPRO_PDF2DOCX_WORKERS", min(4, os.cpu_count() or 1)))
+app.config['PDF2DOCX_PARALLEL_MIN_PAGES'] = int(os.environ.get("FILEPRO_PDF2DOCX_PARALLEL_MIN_PAGES", 16))
+app.config['PDF2DOCX_PAGES_PER_SEGMENT'] = int(os.environ.get("FILEPRO_PDF2DOCX_PAGES_PER_SEGMENT", 8))
+
+def _optional_positive_int(form, name):
+    value = (form.get(name) or '').strip()
+    if not value:
+        return None
+    if not value.isdigit() or int(value) < 1:
+        raise ValueError(f"'{name}' must be a positive whole number.")
+    return int(value)
+
+def parse_pdf_docx_options(form):
+    # Reads start / end (1-based, inclusive) or pages (e.g. "1-5,9") from a request form.
+    # Raises ValueError on bad input; the page count is only checked once the PDF is opened.
+    start, end = _optional_positive_int(form, 'start'), _optional_positive_int(form, 'end')
+    pages = (form.get('pages') or '').replace(' ', '') or None
+    if pages and (start or end):
+        raise ValueError("Use either 'pages' or 'start'/'end', not both.")
+    if start and end and start > end:
+        raise ValueError("'start' must not be after 'end'.")
+    if pages:
+        parse_page_ranges(pages)
+    return {'start': start, 'end': end, 'pages': pages}
+
+def _parse_pdf_docx_pages(cv, page_indexes, settings, selected_count):
+    # One page per parse_pages call, so progress moves page by page. cv must have these pages loaded.
+    cv.parse_document(**settings)
+    for page in cv.pages:
+        page.skip_parsing = True
+    for done, page_index in enumerate(page_indexes, start=1):
+        cv.pages[page_index].skip_parsing = False
+        cv.parse_pages(**settings)
+        cv.pages[page_index].skip_parsing = True
+        done = count_pool_units() or done # Across all segments when running in a nested pool
+        report_job_progress(0.9 * done / selected_count, f"Parsed page {page_index + 1} ({done} of {selected_count}).")
 
+def _parse_pdf_docx_segment(input_path, page_indexes, json_path, selected_count):
+    # Process pool entry point: parses the given 0-based pages and stores them as pdf2docx JSON.
+    from pdf2docx import Converter as Pdf2DocxConverter
+    cv = Pdf2DocxConverter(input_path)
     try:
-        os.makedirs(temp_image_dir_path, exist_ok=True)
-        # pdf2image saves files directly, output_file is a prefix for those files
-        # it returns a list of PIL Image objects, not paths when output_folder is used.
-        # Let's save them manually to have control over paths.
-        images_pil = pdf_to_images_convert(input_path, fmt='png') # poppler_path can be specified if not in PATH
-        
-        if not images_pil:
-             return False, "No images could be extracted from the PDF.", None
-
-        for i, img_pil in enumerate(images_pil):
-            img_filename = f"{os.path.basename(output_folder_stem_for_naming)}_page_{i+1}.png"
-            img_path = os.path.join(temp_image_dir_path, img_filename)
-            img_pil.save(img_path, "PNG")
-            output_image_paths.append(img_path)
-        
-        if not output_image_paths: # Should not happen if images_pil was populated
-            cleanup_files(temp_image_dir_path)
-            return False, "Image saving failed after extraction.", None
-
-        if len(output_image_paths) == 1:
-            # Move single image out of temp dir directly into converted folder
-            final_single_image_name = os.path.basename(output_image_paths[0])
-            final_single_image_path = os.path.join(app.config['CONVERTED_FOLDER'], final_single_image_name)
-            shutil.move(output_image_paths[0], final_single_image_path)
-            cleanup_files(temp_image_dir_path) # Remove the now empty temp dir
-            return True, f"PDF page converted to image: {final_single_image_name}", final_single_image_path
-        else:
-            zip_filename = f"{os.path.basename(output_folder_stem_for_naming)}_pages.zip"
-            zip_output_path = os.path.join(app.config['CONVERTED_FOLDER'], zip_filename)
-            with zipfile.ZipFile(zip_output_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for img_path in output_image_paths:
-                    zipf.write(img_path, os.path.basename(img_path))
-            
-            cleanup_files(temp_image_dir_path) # remove the temp dir with individual images
-            return True, f"PDF pages converted to images and zipped into: {zip_filename}", zip_output_path
+        settings = cv.default_settings
+        cv.load_pages(pages=page_indexes)
+        _parse_pdf_docx_pages(cv, page_indexes, settings, selected_count)
+        cv.serialize(json_path)
+    finally:
+        cv.close()
+    return len(page_indexes)
+
+@timed_converter('pdf_to_docx')
+def convert_pdf_to_docx_robust(input_path, output_path, start=None, end=None, pages=None):
+    from pdf2docx import Converter as Pdf2DocxConverter # Pulls in PyMuPDF and OpenCV
+    segment_paths = []
+    cv = None
+    try:
+        cv = Pdf2DocxConverter(input_path)
+        page_count = len(cv.fitz_doc)
+        if start or end:
+            pages = f"{start or 1}-{end or ''}"
+        page_indexes = parse_page_ranges(pages, page_count)
+        if not page_indexes:
+            return False, "The PDF has no pages to convert."
+        settings = cv.default_settings
+        cv.load_pages(pages=page_indexes)
+
+        segment_size = max(1, app.config['PDF2DOCX_PAGES_PER_SEGMENT'])
+        segments = [page_indexes[i:i + segment_size] for i in range(0, len(page_indexes), segment_size)]
+        if len(page_indexes) < app.config['PDF2DOCX_PARALLEL_MIN_PAGES']:
+            segments = segments[:1] # Keeps nested_pool from starting processes for it
+
+        with nested_pool(app.config['PDF2DOCX_WORKERS'], len(segments)) as pool:
+            if pool is None:
+                _parse_pdf_docx_pages(cv, page_indexes, settings, len(page_indexes))
+            else:
+                segment_stem = os.path.join(app.config['UPLOAD_FOLDER'], f"pdf2docx_part_{uuid.uuid4().hex}")
+                segment_paths = [f"{segment_stem}_{index}.json" for index in range(len(segments))]
+                futures = [pool.submit(run_pool_task, _parse_pdf_docx_segment, input_path, segment, segment_path, len(page_indexes))
+                           for segment, segment_path in zip(segments, segment_paths)]
+                for future in as_completed(futures):
+                    apply_pool_events(future.result()[1])
+        for segment_path in segment_paths:
+            cv.deserialize(segment_path)
+
+        cv.make_docx(output_path, **settings)
+        metrics.inc('filepro_pages_processed_total', len(page_indexes), converter='pdf_to_docx')
+        if len(page_indexes) == page_count:
+            return True, "PDF converted to DOCX successfully."
+        return True, f"PDF converted to DOCX successfully ({len(page_indexes)} of {page_count} pages)."
+    except ValueError as e: # Page selection outside the document
+        return False, str(e)
+    except Exception as e:
+        app.logger.error(f"pdf2docx conversion error: {e}", exc_info=True)
+        return False, f"PDF to DOCX conversion failed. Error: {str(e)}. Complex PDFs may not convert well."
+    finally:
+        if cv is not None:
+            cv.close()
+        cleanup_files(*segment_paths)
+
+# --- Streaming PDF -> Images ---
+# Pages are rendered a few at a time, so peak memory depends on the window size and DPI,
+# not on the page count. PNGs are already compressed, so they go into ZIPs as ZIP_STORED.
+app.config['PDF_RENDER_WINDOW'] = int(os.environ.get("FILEPRO_PDF_RENDER_WINDOW", 4)) # Pages rendered per poppler call
+DEFAULT_RENDER_DPI = 200 # pdf2image's own default
+MAX_RENDER_DPI = 600
+
+def parse_pdf_render_options(form):
+    # Reads dpi / first_page / last_page / grayscale from a request form. Raises ValueError on bad input.
+    dpi = _optional_positive_int(form, 'dpi') or DEFAULT_RENDER_DPI
+    if dpi > MAX_RENDER_DPI:
+        raise ValueError(f"'dpi' must be at most {MAX_RENDER_DPI}.")
+    first_page, last_page = _optional_positive_int(form, 'first_page'), _optional_positive_int(form, 'last_page')
+    if first_page and last_page and first_page > last_page:
+        raise ValueError("'first_page' must not be after 'last_page'.")
+    grayscale = (form.get('grayscale') or '').lower() in ('1', 'true', 'yes', 'on')
+    return {'dpi': dpi, 'first_page': first_page, 'last_page': last_page, 'grayscale': grayscale}
+
+def resolve_pdf_page_range(input_path, first_page=None, last_page=None):
+    # Clamps the requested range to the document. Only reads the PDF info dict, nothing is rendered.
+    from pdf2image import pdfinfo_from_path
+    page_count = int(pdfinfo_from_path(input_path)['Pages'])
+    first = first_page or 1
+    last = min(last_page or page_count, page_count)
+    if page_count < 1 or first > last:
+        raise ValueError(f"Requested pages are outside the document ({page_count} page(s)).")
+    return first, last
+
+def iter_pdf_page_images(input_path, first, last, dpi=DEFAULT_RENDER_DPI, grayscale=False):
+    # Yields (page_number, png_bytes) for pages first..last (1-based, inclusive).
+    from pdf2image import convert_from_path as pdf_to_images_convert # Needs poppler
+    window = max(1, app.config['PDF_RENDER_WINDOW'])
+    total = last - first + 1
+    for window_start in range(first, last + 1, window):
+        window_end = min(window_start + window - 1, last)
+        images_pil = pdf_to_images_convert(input_path, dpi=dpi, first_page=window_start, last_page=window_end,
+                                           grayscale=grayscale, fmt='png') # poppler_path can be specified if not in PATH
+        for offset, img_pil in enumerate(images_pil):
+            png_buffer = io.BytesIO()
+            img_pil.save(png_buffer, "PNG")
+            img_pil.close()
+            metrics.inc('filepro_pages_processed_total', converter='pdf_to_images')
+            yield window_start + offset, png_buffer.getvalue()
+        del images_pil
+        report_job_progress((window_end - first + 1) / total, f"Rendered page {window_end} of {last}.")
+
+class _ZipStreamBuffer(io.RawIOBase):
+    # Write-only, non-seekable sink for zipfile.ZipFile. Not being seekable makes zipfile emit
+    # data descriptors, so entries can be flushed to the client as soon as they're written.
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def iter_zip_stream(entries):
+    # entries yields (arcname, data, compress_type), where data is bytes or the path of a file to copy
+    # in chunks. Yields ZIP bytes as they're produced.
+    # Only time spent packing is recorded as the zip_pack stage, not waiting on entries or the client.
+    sink = _ZipStreamBuffer()
+    packing_seconds = 0.0
+    try:
+        with zipfile.ZipFile(sink, 'w') as zipf:
+            for arcname, data, compress_type in entries:
+                packing_started = time.perf_counter()
+                if isinstance(data, bytes):
+                    zipf.writestr(arcname, data, compress_type=compress_type)
+                    packing_seconds += time.perf_counter() - packing_started
+                    yield sink.drain()
+                    continue
+                zinfo = zipfile.ZipInfo.from_file(data, arcname)
+                zinfo.compress_type = compress_type
+                with open(data, 'rb') as src, zipf.open(zinfo, 'w', force_zip64=zinfo.file_size > zipfile.ZIP64_LIMIT) as dst:
+                    for chunk in iter(lambda: src.read(IO_CHUNK_SIZE), b''):
+                        dst.write(chunk)
+                        packing_seconds += time.perf_counter() - packing_started
+                        yield sink.drain()
+                        packing_started = time.perf_counter()
+                packing_seconds += time.perf_counter() - packing_started
+                yield sink.drain()
+        yield sink.drain() # Central directory
+    finally:
+        route = request.endpoint if has_request_context() else 'worker'
+        metrics.observe('filepro_stage_duration_seconds', packing_seconds, route=route, stage='zip_pack')
+
+
+@timed_converter('pdf_to_images')
+def convert_pdf_to_images_robust(input_path, output_folder_stem_for_naming, dpi=DEFAULT_RENDER_DPI, first_page=None, last_page=None, grayscale=False): # Returns path to zip or single image
+    # output_folder_stem_for_naming is like "converted/uniqueid_output"
+    # Pages are rendered window by window and written straight into the final PNG/ZIP, no temp dir.
+    stem_name = os.path.basename(output_folder_stem_for_naming)
+    output_path = None
+    try:
+        first, last = resolve_pdf_page_range(input_path, first_page, last_page)
+        pages = iter_pdf_page_images(input_path, first, last, dpi=dpi, grayscale=grayscale)
+
+        if first == last:
+            page_number, png_bytes = next(pages)
+            final_single_image_name = f"{stem_name}_page_{page_number}.png"
+            output_path = os.path.join(os.path.dirname(output_folder_stem_for_naming), final_single_image_name)
+            with open(output_path, 'wb') as f:
+                f.write(png_bytes)
+            return True, f"PDF page converted to image: {final_single_image_name}", output_path
+
+        zip_filename = f"{stem_name}_pages.zip"
+        output_path = os.path.join(os.path.dirname(output_folder_stem_for_naming), zip_filename)
+        packing_seconds = 0.0
+        with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_STORED) as zipf:
+            for page_number, png_bytes in pages:
+                packing_started = time.perf_counter()
+                zipf.writestr(f"{stem_name}_page_{page_number}.png", png_bytes)
+                packing_seconds += time.perf_counter() - packing_started
+        metrics.observe('filepro_stage_duration_seconds', packing_seconds, route='worker', stage='zip_pack')
+        return True, f"PDF pages converted to images and zipped into: {zip_filename}", output_path
 
+    except ValueError as e: # Page selection outside the document
+        cleanup_files(output_path)
+        return False, str(e), None
     except Exception as e:
         app.logger.error(f"PDF to Images conversion error: {e}", exc_info=True)
-        cleanup_files(temp_image_dir_path if 'temp_image_dir_path' in locals() else None, *output_image_paths)
+        cleanup_files(output_path)
         return False, f"Failed to convert PDF to images. Ensure Poppler is installed and in PATH. Error: {str(e)}", None
 
-def convert_pptx_to_pdf_basic(input_path, output_path): # Same
+# --- PPTX -> PDF (basic layout) ---
+# Picture blobs are decoded from memory, once per distinct blob (by hash), and drawn into a shared
+# form XObject, so a logo on every slide is embedded once and only placed per slide.
+# Big decks are rendered in slide chunks on a process pool and stitched with the incremental merge,
+# whose resource dedup collapses images repeated across chunks.
+app.config['PPTX_RENDER_WORKERS'] = int(os.environ.get("FILEPRO_PPTX_RENDER_WORKERS", min(4, os.cpu_count() or 1)))
+app.config['PPTX_PARALLEL_MIN_SLIDES'] = int(os.environ.get("FILEPRO_PPTX_PARALLEL_MIN_SLIDES", 40))
+app.config['PPTX_SLIDES_PER_CHUNK'] = int(os.environ.get("FILEPRO_PPTX_SLIDES_PER_CHUNK", 25))
+EMU_PER_POINT = 12700 # 914400 EMU per inch / 72 points per inch
+
+def _draw_pptx_picture(c, blob, image_forms, x, y, width, height):
+    from reportlab.lib.boxstuff import aspectRatioFix
+    from reportlab.lib.utils import ImageReader as ReportlabImageReader
+    key = hashlib.sha1(blob).hexdigest()
+    form = image_forms.get(key)
+    if form is None:
+        rl_image = ReportlabImageReader(io.BytesIO(blob))
+        image_width, image_height = rl_image.getSize()
+        form_name = f"pptx_img_{key}"
+        c.beginForm(form_name, lowerx=0, lowery=0, upperx=1, uppery=1) # Unit square, scaled when placed
+        c.drawImage(rl_image, 0, 0, width=1, height=1, mask='auto')
+        c.endForm()
+        form = image_forms[key] = (form_name, image_width, image_height)
+    form_name, image_width, image_height = form
+    x, y, width, height, _ = aspectRatioFix(True, 'c', x, y, width, height, image_width, image_height) # preserveAspectRatio
+    c.saveState()
+    c.translate(x, y)
+    c.scale(width, height)
+    c.doForm(form_name)
+    c.restoreState()
+
+def _render_pptx_slides(prs, output_path, slide_indexes, slide_count=None):
+    # slide_count is the deck's total for progress reports, when rendering one chunk of it
+    from reportlab.pdfgen import canvas as reportlab_canvas
+    # Calculate page size in points (1 inch = 72 points, EMU / 914400 = inches)
+    page_width_pt = prs.slide_width.emu / EMU_PER_POINT
+    page_height_pt = prs.slide_height.emu / EMU_PER_POINT
+
+    c = reportlab_canvas.Canvas(output_path, pagesize=(page_width_pt, page_height_pt))
+    image_forms = {} # blob sha1 -> (form name, pixel width, pixel height)
+    slides = prs.slides
+
+    for slide_idx in slide_indexes:
+        slide = slides[slide_idx]
+        for shape in slide.shapes:
+            left_pt = shape.left.emu / EMU_PER_POINT
+            top_pt = shape.top.emu / EMU_PER_POINT
+            width_pt = shape.width.emu / EMU_PER_POINT
+            height_pt = shape.height.emu / EMU_PER_POINT
+            y_pos_reportlab = page_height_pt - top_pt - height_pt # ReportLab Y is from bottom
+
+            if hasattr(shape, "text_frame") and shape.text_frame and shape.text_frame.text:
+                text_object = c.beginText(left_pt + 5, y_pos_reportlab + height_pt - 15) # Crude baseline adjust
+                # Basic font styling attempt
+                try:
+                    first_run_font = shape.text_frame.paragraphs[0].runs[0].font
+                    font_name = first_run_font.name if first_run_font.name else "Helvetica"
+                    font_size = first_run_font.size.pt if first_run_font.size else 10
+                    text_object.setFont(font_name, font_size)
+                    if first_run_font.bold: text_object.setFont(font_name+"-Bold", font_size) # Assumes bold variant exists
+                    if first_run_font.italic: text_object.setFont(font_name+"-Oblique", font_size) # Assumes italic variant
+                except:
+                    text_object.setFont("Helvetica", 10) # Fallback
+
+                for paragraph in shape.text_frame.paragraphs:
+                    for run in paragraph.runs:
+                        text_object.textLine(run.text)
+                c.drawText(text_object)
+
+            if shape.shape_type == 13:  # MSO_SHAPE_TYPE.PICTURE
+                try:
+                    _draw_pptx_picture(c, shape.image.blob, image_forms, left_pt, y_pos_reportlab, width_pt, height_pt)
+                except Exception as img_ex:
+                    app.logger.warning(f"Could not process image in PPTX slide {slide_idx+1}: {img_ex}")
+        c.showPage()
+        metrics.inc('filepro_pages_processed_total', converter='pptx_to_pdf')
+        done = count_pool_units() or (slide_idx + 1) # Across all chunks when running in a nested pool
+        report_job_progress(0.9 * done / (slide_count or len(slides)), f"Rendered {done} of {slide_count or len(slides)} slides.")
+    c.save()
+
+def _render_pptx_chunk(input_path, output_path, start, stop, slide_count):
+    # Process pool entry point: renders slides [start, stop) to their own PDF.
+    from pptx import Presentation
+    _render_pptx_slides(Presentation(input_path), output_path, range(start, stop), slide_count)
+    return stop - start
+
+@timed_converter('pptx_to_pdf')
+def convert_pptx_to_pdf_basic(input_path, output_path):
+    from pptx import Presentation
+    part_paths = []
     try:
         prs = Presentation(input_path)
-        # Calculate page size in points (1 inch = 72 points, EMU / 914400 = inches)
-        page_width_pt = prs.slide_width.emu / 12700  # 914400 / 72 = 12700
-        page_height_pt = prs.slide_height.emu / 12700
-        
-        c = reportlab_canvas.Canvas(output_path, pagesize=(page_width_pt, page_height_pt))
-
-        for slide_idx, slide in enumerate(prs.slides):
-            for shape in slide.shapes:
-                left_pt = shape.left.emu / 12700
-                top_pt = shape.top.emu / 12700
-                width_pt = shape.width.emu / 12700
-                height_pt = shape.height.emu / 12700
-                y_pos_reportlab = page_height_pt - top_pt - height_pt # ReportLab Y is from bottom
-
-                if hasattr(shape, "text_frame") and shape.text_frame and shape.text_frame.text:
-                    text_object = c.beginText(left_pt + 5, y_pos_reportlab + height_pt - 15) # Crude baseline adjust
-                    # Basic font styling attempt
-                    try:
-                        first_run_font = shape.text_frame.paragraphs[0].runs[0].font
-                        font_name = first_run_font.name if first_run_font.name else "Helvetica"
-                        font_size = first_run_font.size.pt if first_run_font.size else 10
-                        text_object.setFont(font_name, font_size)
-                        if first_run_font.bold: text_object.setFont(font_name+"-Bold", font_size) # Assumes bold variant exists
-                        if first_run_font.italic: text_object.setFont(font_name+"-Oblique", font_size) # Assumes italic variant
-                    except:
-                        text_object.setFont("Helvetica", 10) # Fallback
-
-                    for paragraph in shape.text_frame.paragraphs:
-                        for run in paragraph.runs:
-                            text_object.textLine(run.text)
-                    c.drawText(text_object)
-
-                if shape.shape_type == 13:  # MSO_SHAPE_TYPE.PICTURE
-                    try:
-                        image = shape.image
-                        img_bytes = image.blob
-                        temp_img_path = os.path.join(app.config['UPLOAD_FOLDER'], f"temp_img_{uuid.uuid4().hex}.{image.ext}")
-                        with open(temp_img_path, 'wb') as tmp_img_file:
-                            tmp_img_file.write(img_bytes)
-                        
-                        rl_image = ReportlabImageReader(temp_img_path)
-                        c.drawImage(rl_image, left_pt, y_pos_reportlab, width=width_pt, height=height_pt, preserveAspectRatio=True, mask='auto')
-                        cleanup_files(temp_img_path)
-                    except Exception as img_ex:
-                        app.logger.warning(f"Could not process image in PPTX slide {slide_idx+1}: {img_ex}")
-            c.showPage()
-        c.save()
+        slide_count = len(prs.slides)
+        chunk_size = max(1, app.config['PPTX_SLIDES_PER_CHUNK'])
+        chunks = [(start, min(start + chunk_size, slide_count)) for start in range(0, slide_count, chunk_size)]
+        if slide_count < app.config['PPTX_PARALLEL_MIN_SLIDES']:
+            chunks = chunks[:1] # Keeps nested_pool from starting processes for it
+
+        with nested_pool(app.config['PPTX_RENDER_WORKERS'], len(chunks)) as pool:
+            if pool is None:
+                _render_pptx_slides(prs, output_path, range(slide_count))
+                return True, "PPTX converted to PDF with basic layout."
+            del prs # Each worker parses its own copy
+            part_stem = os.path.join(app.config['UPLOAD_FOLDER'], f"pptx_part_{uuid.uuid4().hex}")
+            part_paths = [f"{part_stem}_{index}.pdf" for index in range(len(chunks))]
+            futures = [pool.submit(run_pool_task, _render_pptx_chunk, input_path, part_path, start, stop, slide_count)
+                       for part_path, (start, stop) in zip(part_paths, chunks)]
+            for future in as_completed(futures):
+                apply_pool_events(future.result()[1])
+
+        success, message, _ = merge_pdf_files_incremental([(part_path, None) for part_path in part_paths], output_path)
+        if not success:
+            return False, f"Failed to assemble PPTX slides into a PDF. {message}"
         return True, "PPTX converted to PDF with basic layout."
     except Exception as e:
         app.logger.error(f"PPTX to PDF basic conversion error: {e}", exc_info=True)
         return False, f"Failed to convert PPTX to PDF. Error: {str(e)}"
+    finally:
+        cleanup_files(*part_paths)
+
 
 # --- Merging Functions (Same as before, ensure they are robust) ---
+@timed_converter('merge_pdf')
 def merge_pdf_files_robust(input_file_paths, output_path): # Same
+    from PyPDF2 import PdfMerger # PyPDF2 3.0+
     merger = PdfMerger()
     try:
         for pdf_path in input_file_paths:
@@ -200,7 +787,208 @@ def merge_pdf_files_robust(input_file_paths, output_path): # Same
         merger.close()
 
 
+# --- Incremental PDF Merge ---
+# PdfMerger keeps every input open and its whole object graph in memory until write(). This engine
+# reads one input at a time from its file handle (PdfReader(path) would slurp the whole file), copies
+# only the selected pages, points fonts/images that are byte-identical to ones from earlier inputs
+# at the first copy, and releases the input before opening the next. Objects orphaned by that
+# are dropped before the single write at the end, since PyPDF2 can't stream objects out as it goes.
+RESOURCE_CATEGORIES = ('/XObject', '/Font')
+RSS_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+def parse_page_ranges(spec, page_count=None):
+    # "1-5,9" -> [0, 1, 2, 3, 4, 8]. 1-based and inclusive in, 0-based out; "7-" runs to the last page.
+    # Blank means every page. With page_count=None only the syntax is checked. Raises ValueError.
+    spec = (spec or '').replace(' ', '')
+    if not spec:
+        return list(range(page_count)) if page_count is not None else []
+    indexes = []
+    for part in spec.split(','):
+        start, dash, end = part.partition('-')
+        if not start.isdigit() or (end and not end.isdigit()) or (not dash and end):
+            raise ValueError(f"Invalid page range '{part}'. Use a form like 1-5,9.")
+        first = int(start)
+        last = int(end) if end else (page_count if dash else first)
+        if last is None: # Open-ended range and we don't know the page count yet
+            last = first
+        if page_count is not None and max(first, last) > page_count: # Also "25-" on a 20-page document
+            raise ValueError(f"Page range '{part}' is outside the document ({page_count} page(s)).")
+        if first < 1 or last < first:
+            raise ValueError(f"Invalid page range '{part}'.")
+        indexes.extend(range(first - 1, last))
+    return indexes
+
+def current_rss_bytes():
+    # This process's resident memory right now, or None where /proc isn't available (e.g. macOS).
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * RSS_PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+class RssPeakSampler:
+    # Samples resident memory on a thread while the block runs. ru_maxrss is the process's lifetime
+    # high-water mark and says nothing about one merge; tracemalloc would, but slows PyPDF2 down ~5x.
+    # The samples cover the whole process: exact in a job worker, which runs one job at a time, and
+    # including concurrent requests when run in a threaded web process.
+    def __init__(self, interval_seconds=0.005):
+        self.interval_seconds = interval_seconds
+        self.start_bytes = self.peak_bytes = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval_seconds):
+            self.peak_bytes = max(self.peak_bytes, current_rss_bytes() or 0)
+
+    def __enter__(self):
+        self.start_bytes = self.peak_bytes = current_rss_bytes()
+        if self.start_bytes is not None:
+            self._thread = threading.Thread(target=self._sample, name="rss-sampler", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self.peak_bytes = max(self.peak_bytes, current_rss_bytes() or 0)
+        return False
+
+    def growth_bytes(self):
+        return None if self.start_bytes is None else self.peak_bytes - self.start_bytes
+
+def _pdf_object_fingerprint(obj, memo):
+    # Content hash of a PDF object, following references, so two copies of the same font or image
+    # from different inputs hash the same even though their object numbers differ.
+    from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+
+    def fingerprint(obj, depth):
+        if isinstance(obj, IndirectObject):
+            obj = obj.get_object()
+        if id(obj) in memo:
+            return memo[id(obj)]
+        digest = hashlib.sha256(type(obj).__name__.encode())
+        if depth > 32:
+            digest.update(str(id(obj)).encode()) # Too deep to be a plain resource, never treat as a duplicate
+        elif isinstance(obj, DictionaryObject): # Includes streams
+            for key in sorted(obj.keys()):
+                if key in ('/Length', '/Parent'):
+                    continue
+                digest.update(key.encode())
+                digest.update(fingerprint(obj[key], depth + 1).encode())
+            if isinstance(obj, StreamObject):
+                data = obj._data
+                digest.update(data.encode('latin-1') if isinstance(data, str) else data)
+        elif isinstance(obj, ArrayObject):
+            for item in obj:
+                digest.update(fingerprint(item, depth + 1).encode())
+                digest.update(b',')
+        else:
+            digest.update(repr(obj).encode())
+        memo[id(obj)] = digest.hexdigest()
+        return memo[id(obj)]
+
+    return fingerprint(obj, 0)
+
+def _dedupe_page_resources(resources, canonical_refs, memo, visited):
+    # Repoints /XObject and /Font entries at the first identical object seen in this merge.
+    # Returns how many entries were repointed. Recurses into form XObjects' own resources.
+    from PyPDF2.generic import DictionaryObject, IndirectObject, NameObject
+    if isinstance(resources, IndirectObject):
+        resources = resources.get_object()
+    if not isinstance(resources, DictionaryObject) or id(resources) in visited:
+        return 0
+    visited.add(id(resources))
+    repointed = 0
+    for category in RESOURCE_CATEGORIES:
+        entries = resources.get(category)
+        entries = entries.get_object() if entries is not None else None
+        if not isinstance(entries, DictionaryObject):
+            continue
+        for name, ref in list(entries.items()):
+            if not isinstance(ref, IndirectObject):
+                continue
+            fingerprint = _pdf_object_fingerprint(ref, memo)
+            canonical = canonical_refs.setdefault(fingerprint, ref)
+            if canonical.idnum != ref.idnum:
+                entries[NameObject(name)] = canonical
+                repointed += 1
+            nested = canonical.get_object().get('/Resources')
+            if nested is not None:
+                repointed += _dedupe_page_resources(nested, canonical_refs, memo, visited)
+    return repointed
+
+def _drop_unreachable_objects(writer):
+    # Replaces objects nothing points at any more (the losers of deduplication) with null,
+    # which keeps the xref numbering intact. Returns how many were dropped.
+    from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NullObject
+    reachable = set()
+    stack = [writer._root, writer._info]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, IndirectObject):
+            if obj.pdf is not writer or obj.idnum in reachable:
+                continue
+            reachable.add(obj.idnum)
+            obj = writer.get_object(obj)
+        if isinstance(obj, DictionaryObject):
+            stack.extend(obj.values())
+        elif isinstance(obj, ArrayObject):
+            stack.extend(obj)
+    dropped = 0
+    for index, obj in enumerate(writer._objects):
+        if index + 1 not in reachable and obj is not None and not isinstance(obj, NullObject):
+            writer._objects[index] = NullObject()
+            dropped += 1
+    return dropped
+
+@timed_converter('merge_pdf_incremental')
+def merge_pdf_files_incremental(input_specs, output_path):
+    # input_specs: list of (pdf_path, page_range_spec or None). Returns (success, message, stats).
+    from PyPDF2 import PdfReader, PdfWriter
+    started = time.perf_counter()
+    stats = {'inputs': len(input_specs), 'pages': 0, 'input_bytes': 0, 'output_bytes': 0,
+             'deduplicated_resources': 0, 'dropped_objects': 0, 'seconds': None}
+    writer = PdfWriter()
+    canonical_refs, memo = {}, {}
+    try:
+        for spec_index, (pdf_path, page_range_spec) in enumerate(input_specs):
+            stats['input_bytes'] += os.path.getsize(pdf_path)
+            with open(pdf_path, 'rb') as pdf_file:
+                reader = PdfReader(pdf_file)
+                page_indexes = parse_page_ranges(page_range_spec, len(reader.pages))
+                for page_index in page_indexes:
+                    page = writer.add_page(reader.pages[page_index])
+                    stats['deduplicated_resources'] += _dedupe_page_resources(page.get('/Resources'), canonical_refs, memo, set())
+                stats['pages'] += len(page_indexes)
+                metrics.inc('filepro_pages_processed_total', len(page_indexes), converter='merge_pdf_incremental')
+                # PyPDF2 remembers cloned objects by id(reader); a later reader can reuse that id
+                writer._id_translated.pop(id(reader), None)
+                del reader
+            report_job_progress((spec_index + 1) / (len(input_specs) + 1), f"Merged file {spec_index + 1} of {len(input_specs)}.")
+
+        if stats['pages'] == 0:
+            return False, "The selected page ranges don't contain any pages.", stats
+        stats['dropped_objects'] = _drop_unreachable_objects(writer)
+        with open(output_path, 'wb') as out:
+            writer.write(out)
+        stats['output_bytes'] = os.path.getsize(output_path)
+        return True, f"PDF files merged successfully ({stats['pages']} pages).", stats
+    except ValueError as e: # Bad page range for this document
+        cleanup_files(output_path)
+        return False, str(e), stats
+    except Exception as e:
+        app.logger.error(f"Incremental PDF merge error: {e}", exc_info=True)
+        cleanup_files(output_path)
+        return False, f"Failed to merge PDF files. Error: {str(e)}", stats
+    finally:
+        stats['seconds'] = round(time.perf_counter() - started, 3)
+
+
+@timed_converter('merge_docx')
 def merge_docx_files_robust(input_file_paths, output_path): # Same basic append
+    from docx import Document as DocxDocument
     try:
         if not input_file_paths: return False, "No DOCX files provided."
         
@@ -227,6 +1015,1460 @@ def merge_docx_files_robust(input_file_paths, output_path): # Same basic append
         return False, f"Failed to merge DOCX files. Error: {str(e)}"
 
 
+# --- Converter Registry ---
+# Conversions are looked up by (input extension, target format). Each entry names the backends it
+# needs; those are only imported when a converter first runs, so a worker that never converts a PDF
+# never loads pdf2docx/PyMuPDF/OpenCV. FILEPRO_PREWARM ("all" or a comma-separated list of backend
+# names) imports backends at startup instead; under `gunicorn --preload` that happens in the master,
+# and forked workers share those pages copy-on-write.
+BACKEND_MODULES = {
+    'pillow': ('PIL.Image', 'PIL.ImageOps'),
+    'pypdf2': ('PyPDF2', 'PyPDF2.generic'),
+    'python-docx': ('docx',),
+    'python-pptx': ('pptx',),
+    'reportlab': ('reportlab.pdfgen.canvas', 'reportlab.lib.utils', 'reportlab.lib.boxstuff'),
+    'docx2pdf': ('docx2pdf',),
+    'pdf2image': ('pdf2image',),
+    'pdf2docx': ('pdf2docx',),
+    'img2pdf': ('img2pdf',),
+}
+app.config['PREWARM_BACKENDS'] = os.environ.get("FILEPRO_PREWARM", "")
+
+metrics.describe('filepro_backend_import_seconds_total', 'counter', "Time spent importing converter backends, summed over the web and job processes.")
+
+CONVERTERS = {} # (input_ext, target_format) -> {'func', 'output_ext', 'backends', 'parse_options'}
+
+def register_converter(input_ext, target_format, func, output_ext=None, backends=(), parse_options=None):
+    # func(input_path, output_path, **options) returns (success, message) or (success, message, actual_output_path).
+    # parse_options(form) turns request form fields into those options and raises ValueError on bad input.
+    CONVERTERS[(input_ext, target_format)] = {'func': func, 'output_ext': output_ext or target_format,
+                                              'backends': tuple(backends), 'parse_options': parse_options}
+
+def get_converter(input_ext, target_format):
+    return CONVERTERS.get((input_ext, target_format))
+
+def load_backend(name):
+    # Imports a backend's modules (a no-op once they're in sys.modules) and records how long that took.
+    modules = BACKEND_MODULES[name]
+    if all(module in sys.modules for module in modules):
+        return
+    started = time.perf_counter()
+    for module in modules:
+        importlib.import_module(module)
+    metrics.inc('filepro_backend_import_seconds_total', time.perf_counter() - started, backend=name)
+
+def prewarm_backends(spec):
+    names = list(BACKEND_MODULES) if spec.strip().lower() == 'all' else [n.strip() for n in spec.split(',') if n.strip()]
+    for name in names:
+        if name not in BACKEND_MODULES:
+            app.logger.warning(f"FILEPRO_PREWARM: unknown backend '{name}', expected one of {', '.join(BACKEND_MODULES)}.")
+            continue
+        try:
+            load_backend(name)
+        except ImportError as e:
+            app.logger.warning(f"FILEPRO_PREWARM: could not import backend '{name}': {e}")
+
+def _convert_pdf_to_images_entry(input_path, output_path, **options):
+    # The images converter names its own output (one PNG or a ZIP) after the path stem.
+    return convert_pdf_to_images_robust(input_path, os.path.splitext(output_path)[0], **options)
+
+def _convert_image_to_pdf_entry(input_path, output_path, **options):
+    return convert_images_to_pdf_robust([input_path], output_path, **options)
+
+register_converter('pdf', 'docx', convert_pdf_to_docx_robust, backends=('pdf2docx',), parse_options=parse_pdf_docx_options)
+register_converter('pdf', 'images', _convert_pdf_to_images_entry, output_ext='zip', backends=('pdf2image', 'pillow'),
+                   parse_options=parse_pdf_render_options)
+register_converter('docx', 'pdf', convert_docx_to_pdf_robust, backends=('docx2pdf',))
+register_converter('pptx', 'pdf', convert_pptx_to_pdf_basic, backends=('python-pptx', 'reportlab', 'pypdf2'))
+for image_ext in IMAGE_EXTENSIONS:
+    register_converter(image_ext, 'pdf', _convert_image_to_pdf_entry, backends=('img2pdf', 'pillow', 'pypdf2'), parse_options=parse_image_options)
+    for target_ext in IMAGE_EXTENSIONS:
+        register_converter(image_ext, target_ext, convert_image_format, backends=('pillow',), parse_options=parse_image_options)
+
+if app.config['PREWARM_BACKENDS']:
+    prewarm_backends(app.config['PREWARM_BACKENDS'])
+
+
+# --- Dispatch Helpers (shared by the routes and the job workers) ---
+def perform_conversion(input_ext, target_format, input_filepath, output_filename_stem, options=None, output_folder=None):
+    # Returns (success, message, output_path). output_filename_stem is a bare name, e.g. "<uuid>_output".
+    # options holds converter-specific keyword arguments, e.g. the PDF render options.
+    # output_folder defaults to CONVERTED_FOLDER; pipelines put intermediates in their scratch dir.
+    converter = get_converter(input_ext, target_format)
+    if converter is None:
+        return False, f"Conversion from .{input_ext} to .{target_format} is not supported.", None
+    # Default output path, the converter may return a different one (e.g. a single PNG instead of a ZIP)
+    output_filepath_final_on_server = os.path.join(output_folder or app.config['CONVERTED_FOLDER'], f"{output_filename_stem}.{converter['output_ext']}")
+    pair = f"{input_ext}_to_{target_format}"
+    started = time.perf_counter()
+    try:
+        for backend in converter['backends']:
+            load_backend(backend)
+        result = converter['func'](input_filepath, output_filepath_final_on_server, **(options or {}))
+        success, message = result[:2]
+        if success and len(result) > 2 and result[2]:
+            output_filepath_final_on_server = result[2]
+    except Exception:
+        cleanup_files(output_filepath_final_on_server)
+        metrics.inc('filepro_conversions_total', pair=pair, outcome='error')
+        raise
+
+    metrics.observe('filepro_conversion_duration_seconds', time.perf_counter() - started, pair=pair)
+    metrics.inc('filepro_conversions_total', pair=pair, outcome='success' if success else 'failure')
+    metrics.inc('filepro_bytes_in_total', _total_file_size(input_filepath), pair=pair)
+    if not success:
+        cleanup_files(output_filepath_final_on_server)
+    else:
+        metrics.inc('filepro_bytes_out_total', _total_file_size(output_filepath_final_on_server), pair=pair)
+    return success, message, output_filepath_final_on_server
+
+def perform_merge(merge_type, input_file_paths, output_path, page_ranges=None, merge_mode='standard', image_options=None):
+    # Returns (success, message, output_path, stats); the job queue passes stats through as job details.
+    # page_ranges is a list of specs parallel to input_file_paths and implies the incremental engine.
+    # merge_type 'images' puts one image per page into a PDF, image_options as for convert_images_to_pdf_robust.
+    # Every merge reports its sizes, time and peak memory; the incremental engine adds page and dedup counts.
+    success = False
+    message = "Merge process initiated." # Default message
+    pair = f"merge_{merge_type}"
+    input_bytes = _total_file_size(*input_file_paths)
+    incremental = merge_type == 'pdf' and (merge_mode == 'incremental' or any(page_ranges or []))
+    stats = {'engine': 'incremental' if incremental else 'standard', 'inputs': len(input_file_paths),
+             'input_bytes': input_bytes, 'output_bytes': 0}
+    started = time.perf_counter()
+    try:
+        with RssPeakSampler() as memory:
+            if incremental:
+                input_specs = list(zip(input_file_paths, page_ranges or [None] * len(input_file_paths)))
+                success, message, engine_stats = merge_pdf_files_incremental(input_specs, output_path)
+                stats.update(engine_stats)
+            elif merge_type == 'pdf':
+                success, message = merge_pdf_files_robust(input_file_paths, output_path)
+            elif merge_type == 'docx':
+                success, message = merge_docx_files_robust(input_file_paths, output_path)
+            elif merge_type == 'images':
+                success, message = convert_images_to_pdf_robust(input_file_paths, output_path, **(image_options or {}))
+            # Add other merge types if implemented
+    except Exception:
+        cleanup_files(output_path)
+        metrics.inc('filepro_conversions_total', pair=pair, outcome='error')
+        raise
+    stats.update(seconds=round(time.perf_counter() - started, 3), peak_rss_bytes=memory.peak_bytes,
+                 rss_growth_bytes=memory.growth_bytes())
+
+    metrics.observe('filepro_conversion_duration_seconds', time.perf_counter() - started, pair=pair)
+    metrics.inc('filepro_conversions_total', pair=pair, outcome='success' if success else 'failure')
+    metrics.inc('filepro_bytes_in_total', input_bytes, pair=pair)
+    if not success:
+        cleanup_files(output_path) # Clean failed merge output
+    else:
+        stats['output_bytes'] = _total_file_size(output_path)
+        metrics.inc('filepro_bytes_out_total', stats['output_bytes'], pair=pair)
+    app.logger.info(f"Merge stats ({pair}): {stats}")
+    return success, message, output_path, stats
+
+
+# --- Pipelines ---
+# A pipeline runs declarative steps over a set of inputs in one request, e.g.
+#   [{"op": "convert", "to": "pdf"}, {"op": "merge"}, {"op": "convert", "to": "images", "dpi": 100}]
+# "convert" converts every current item (items already in the target format pass through) and
+# takes the same options as /convert. "merge" combines all items into one; PDFs accept
+# "page_ranges" (one spec per item) and "mode", and images become one PDF. Converting to PDF first
+# makes mixed DOCX + PPTX + image merges possible.
+# The converters and merge engines read and write files, so intermediates are spooled in a
+# per-pipeline scratch dir under UPLOAD_FOLDER. Only the final artifact lands in CONVERTED_FOLDER,
+# as a ZIP when more than one item is left.
+app.config['PIPELINE_MAX_STEPS'] = int(os.environ.get("FILEPRO_PIPELINE_MAX_STEPS", 10))
+MERGEABLE_TYPES = {'pdf': 'pdf', 'docx': 'docx', 'images': 'pdf'} # merge type -> output extension
+
+def _merge_type_for(exts):
+    if all(ext in IMAGE_EXTENSIONS for ext in exts):
+        return 'images'
+    if len(set(exts)) == 1 and exts[0] in MERGEABLE_TYPES:
+        return exts[0]
+    return None
+
+def plan_pipeline(input_exts, steps):
+    # Validates steps against the input types without running anything and returns them
+    # normalized: [{'op', 'to', 'options', 'input_exts', ...}], input_exts being the planned type of each
+    # item the step gets. Raises ValueError with a message for the client.
+    if not isinstance(steps, list) or not steps:
+        raise ValueError("'steps' must be a non-empty JSON list.")
+    if len(steps) > app.config['PIPELINE_MAX_STEPS']:
+        raise ValueError(f"A pipeline may have at most {app.config['PIPELINE_MAX_STEPS']} steps.")
+    exts = list(input_exts)
+    planned = []
+    for number, step in enumerate(steps, start=1):
+        if not isinstance(step, dict):
+            raise ValueError(f"Step {number} must be a JSON object.")
+        form = {key: str(value) for key, value in step.items() if value is not None}
+        if 'zip' in exts:
+            raise ValueError(f"Step {number}: a ZIP of page images can't be processed further, make it the last step.")
+        op = form.get('op')
+        if op == 'convert':
+            target_format = form.get('to', '').lower()
+            options = {} # Per input extension, since each converter takes its own options
+            for ext in set(exts):
+                if ext == target_format:
+                    continue
+                converter = get_converter(ext, target_format)
+                if converter is None:
+                    raise ValueError(f"Step {number}: conversion from .{ext} to .{target_format} is not supported.")
+                options[ext] = converter['parse_options'](form) if converter['parse_options'] else {}
+            planned.append({'op': 'convert', 'to': target_format, 'options': options, 'input_exts': exts})
+            exts = [ext if ext == target_format else get_converter(ext, target_format)['output_ext'] for ext in exts]
+        elif op == 'merge':
+            merge_type = _merge_type_for(exts)
+            if merge_type is None:
+                raise ValueError(f"Step {number}: can't merge .{', .'.join(sorted(set(exts)))} files together; convert them to PDF first.")
+            page_ranges = step.get('page_ranges')
+            if page_ranges is not None:
+                if merge_type != 'pdf' or not isinstance(page_ranges, list) or len(page_ranges) != len(exts):
+                    raise ValueError(f"Step {number}: 'page_ranges' needs one spec per PDF being merged.")
+                for page_range_spec in page_ranges:
+                    if page_range_spec is not None and not isinstance(page_range_spec, str):
+                        raise ValueError(f"Step {number}: each 'page_ranges' entry must be a string like \"1-5,9\", or null for all pages.")
+                    parse_page_ranges(page_range_spec)
+            merge_mode = form.get('mode', 'standard').lower()
+            if merge_mode not in ('standard', 'incremental'):
+                raise ValueError(f"Step {number}: unknown merge mode '{merge_mode}'.")
+            image_options = parse_image_options(form) if merge_type == 'images' else None
+            planned.append({'op': 'merge', 'to': merge_type, 'page_ranges': page_ranges, 'mode': merge_mode,
+                            'image_options': image_options, 'input_exts': exts})
+            exts = [MERGEABLE_TYPES[merge_type]]
+        else:
+            raise ValueError(f"Step {number}: unknown op '{op}', expected 'convert' or 'merge'.")
+    return planned
+
+def run_pipeline(scratch_dir, items, steps, output_stem):
+    # items: [{'path', 'ext', 'name'}] inside scratch_dir; steps as returned by plan_pipeline.
+    # Returns (success, message, output_path, details) like perform_merge; details holds per-step timings.
+    details = {'steps': []}
+    for index, step in enumerate(steps):
+        started = time.perf_counter()
+        step_dir = os.path.join(scratch_dir, f"step{index + 1}")
+        os.makedirs(step_dir, exist_ok=True)
+        with track_stage(f"pipeline_{step['op']}"), job_progress_span(index / len(steps), (index + 1) / len(steps)):
+            if step['op'] == 'convert':
+                converted = []
+                for item_index, item in enumerate(items):
+                    if item['ext'] == step['to']:
+                        converted.append(item)
+                        continue
+                    with job_progress_span(item_index / len(items), (item_index + 1) / len(items)):
+                        success, message, output_path = perform_conversion(item['ext'], step['to'], item['path'], f"{item_index + 1:03d}_{item['name']}",
+                                                                           step['options'][item['ext']], output_folder=step_dir)
+                    if not success:
+                        return False, f"Step {index + 1} ({item['name']}): {message}", None, details
+                    converted.append({'path': output_path, 'ext': get_file_ext(output_path), 'name': item['name']})
+                items = converted
+            else:
+                output_ext = MERGEABLE_TYPES[step['to']]
+                output_path = os.path.join(step_dir, f"merged.{output_ext}")
+                success, message, _, stats = perform_merge(step['to'], [item['path'] for item in items], output_path,
+                                                           step['page_ranges'], step['mode'], step['image_options'])
+                if not success:
+                    return False, f"Step {index + 1}: {message}", None, details
+                items = [{'path': output_path, 'ext': output_ext, 'name': items[0]['name']}]
+        details['steps'].append({'op': step['op'], 'to': step['to'], 'items': len(items),
+                                 'seconds': round(time.perf_counter() - started, 3)})
+
+    final_path = os.path.join(app.config['CONVERTED_FOLDER'], f"{output_stem}.{items[0]['ext'] if len(items) == 1 else 'zip'}")
+    if len(items) == 1:
+        shutil.move(items[0]['path'], final_path)
+    else:
+        with zipfile.ZipFile(final_path, 'w', zipfile.ZIP_STORED) as zipf: # Converter outputs are already compressed
+            for number, item in enumerate(items, start=1):
+                zipf.write(item['path'], f"{number:03d}_{item['name']}.{item['ext']}")
+    return True, f"Pipeline finished ({len(steps)} step(s)).", final_path, details
+
+
+# --- Background Job Queue ---
+# Conversions and merges can run on a bounded process pool, so a 200-page PDF->DOCX
+# doesn't pin a web worker and CPU-heavy converters aren't serialized by the GIL.
+# Each web process owns its pool; pool workers push progress and metrics back to it over a queue.
+# The job records themselves are JSON files in UPLOAD_FOLDER (job_<id>.json, like the chunked upload
+# metadata), so any web worker can answer GET /jobs/<id>. The default pool size splits the cores
+# between FILEPRO_WEB_WORKERS (or gunicorn's WEB_CONCURRENCY) web processes, so the total stays bounded.
+app.config['WEB_WORKERS'] = max(1, int(os.environ.get("FILEPRO_WEB_WORKERS", os.environ.get("WEB_CONCURRENCY", 1))))
+app.config['JOB_WORKERS'] = int(os.environ.get("FILEPRO_JOB_WORKERS", max(1, (os.cpu_count() or 2) // app.config['WEB_WORKERS'])))
+app.config['JOB_MAX_PENDING'] = int(os.environ.get("FILEPRO_JOB_MAX_PENDING", app.config['JOB_WORKERS'] * 8))
+app.config['JOB_RETENTION_SECONDS'] = int(os.environ.get("FILEPRO_JOB_RETENTION_SECONDS", 3600))
+app.config['BATCH_MAX_FILES'] = int(os.environ.get("FILEPRO_BATCH_MAX_FILES", 50))
+
+_jobs = {} # job_id -> job dict (see submit_job), for the jobs this process owns
+_jobs_lock = threading.Lock()
+_job_executor = None
+_job_executor_lock = threading.Lock()
+
+# Only set inside pool worker processes
+_worker_current_job_id = None
+_worker_progress_span = (0.0, 1.0) # Part of the job's progress bar the running step reports into
+_worker_cpu_slots = None # Semaphore of JOB_WORKERS slots shared by this web process's job workers, see nested_pool
+_nested_units_done = None # Pages/slides done by all tasks of the current nested pool, see count_pool_units
+
+def _job_record_paths(job_id):
+    if not job_id or len(job_id) != 32 or any(ch not in '0123456789abcdef' for ch in job_id):
+        return None, None
+    stem = os.path.join(app.config['UPLOAD_FOLDER'], f"job_{job_id}")
+    return f"{stem}.json", f"{stem}.cancel"
+
+def _save_job_record(job):
+    # Call with _jobs_lock held, so a late progress update can't overwrite the final state.
+    record_path, _ = _job_record_paths(job['id'])
+    temp_path = f"{record_path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, 'w') as f:
+            json.dump({k: v for k, v in job.items() if k != 'future'}, f)
+        os.replace(temp_path, record_path) # Readers never see a half-written record
+    except OSError as e:
+        app.logger.error(f"Could not save job record {job['id']}: {e}")
+
+def load_job(job_id):
+    # Returns a snapshot of the job (without its future), whichever web process owns it, or None.
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is not None:
+            return {k: v for k, v in job.items() if k != 'future'}
+    record_path, _ = _job_record_paths(job_id)
+    if not record_path:
+        return None
+    try:
+        with open(record_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _init_job_worker(event_queue, cpu_slots):
+    global _worker_event_queue, _worker_cpu_slots
+    _worker_event_queue = event_queue
+    _worker_cpu_slots = cpu_slots
+
+def report_job_progress(progress, detail=None):
+    # Safe to call from any converter: it's a no-op unless we're running inside a job worker.
+    if _worker_event_queue is None or _worker_current_job_id is None:
+        return
+    span_start, span_end = _worker_progress_span
+    progress = span_start + (span_end - span_start) * max(0.0, min(1.0, progress))
+    try:
+        _worker_event_queue.put_nowait(('progress', (_worker_current_job_id, progress, detail)))
+    except Exception:
+        pass # Progress is best effort, never fail a conversion over it
+
+@contextmanager
+def job_progress_span(start, end):
+    # Maps the 0..1 progress reported inside the block onto start..end of the job, for jobs
+    # that chain several converters (see run_pipeline).
+    global _worker_progress_span
+    previous = _worker_progress_span
+    _worker_progress_span = (previous[0] + (previous[1] - previous[0]) * start,
+                             previous[0] + (previous[1] - previous[0]) * end)
+    try:
+        yield
+    finally:
+        _worker_progress_span = previous
+
+def _run_job(job_id, func, args):
+    global _worker_current_job_id, _worker_progress_span
+    _worker_current_job_id = job_id
+    _worker_progress_span = (0.0, 1.0)
+    _worker_cpu_slots.acquire() # Waits while another job has borrowed the idle slots
+    try:
+        if os.path.exists(_job_record_paths(job_id)[1]): # Cancelled via another web process while queued
+            raise CancelledError()
+        report_job_progress(0.0, "Processing...")
+        return func(*args)
+    finally:
+        _worker_current_job_id = None
+        _worker_cpu_slots.release()
+
+# Converters that fan out over their own short-lived pool (pdf2docx segments, PPTX chunks) use these.
+# A synchronous request gets the converter's configured worker count. A job gets its own slot plus the
+# job slots that are idle right now: every job holds one of JOB_WORKERS slots while it runs, and borrowed
+# slots keep the next job waiting until they're given back, so the job pool stays the bound on busy
+# processes. Inner tasks of a job report progress and metrics straight to the web process; count_pool_units
+# lets them report pages done across the whole pool. For synchronous requests their metric updates are
+# buffered and handed back with the result.
+class _EventBuffer(list):
+    def put_nowait(self, event):
+        self.append(event)
+
+def _init_nested_worker(event_queue, job_id, progress_span, units_done):
+    global _worker_event_queue, _worker_current_job_id, _worker_progress_span, _nested_units_done
+    _worker_event_queue = event_queue
+    _worker_current_job_id = job_id
+    _worker_progress_span = progress_span
+    _nested_units_done = units_done
+
+@contextmanager
+def nested_pool(configured, tasks):
+    # Yields a process pool for `tasks` parallel sub-tasks, or None when they should run in this process.
+    workers = min(configured, tasks)
+    borrowed = 0
+    if _worker_cpu_slots is not None:
+        while borrowed < workers - 1 and _worker_cpu_slots.acquire(False):
+            borrowed += 1
+        workers = borrowed + 1 # This process only waits on the pool meanwhile
+    try:
+        if workers < 2:
+            yield None
+            return
+        units_done = multiprocessing.Value('i', 0)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_nested_worker,
+                                 initargs=(_worker_event_queue, _worker_current_job_id, _worker_progress_span, units_done)) as pool:
+            yield pool
+    finally:
+        for _ in range(borrowed):
+            _worker_cpu_slots.release()
+
+def count_pool_units(count=1):
+    # In a nested pool task: adds to the pool-wide count of pages/slides done and returns it. None elsewhere.
+    if _nested_units_done is None:
+        return None
+    with _nested_units_done.get_lock():
+        _nested_units_done.value += count
+        return _nested_units_done.value
+
+def run_pool_task(func, *args):
+    # Inner pool entry point: returns (func's result, buffered events) for apply_pool_events().
+    global _worker_event_queue
+    if _worker_event_queue is not None: # Job sub-task: events already went to the web process
+        return func(*args), []
+    _worker_event_queue = _EventBuffer()
+    try:
+        return func(*args), _worker_event_queue
+    finally:
+        _worker_event_queue = None
+
+def apply_pool_events(events):
+    for kind, payload in events:
+        if kind == 'metric':
+            metrics._record(*payload)
+
+def _drain_worker_events(event_queue):
+    # Applies progress updates and metric events sent by pool workers.
+    while True:
+        try:
+            kind, payload = event_queue.get()
+        except (EOFError, OSError):
+            return # Queue torn down with the executor
+        if kind == 'metric':
+            metrics.apply(*payload)
+            continue
+        job_id, progress, detail = payload
+        with _jobs_lock:
+            job = _jobs.get(job_id)
+            if job and job['status'] in ('queued', 'running'):
+                job['status'] = 'running'
+                job['progress'] = progress
+                if detail: job['message'] = detail
+                _save_job_record(job)
+
+def get_job_executor():
+    global _job_executor
+    with _job_executor_lock:
+        if _job_executor is None:
+            event_queue = multiprocessing.Queue()
+            cpu_slots = multiprocessing.Semaphore(app.config['JOB_WORKERS'])
+            _job_executor = ProcessPoolExecutor(max_workers=app.config['JOB_WORKERS'],
+                                                initializer=_init_job_worker, initargs=(event_queue, cpu_slots))
+            threading.Thread(target=_drain_worker_events, args=(event_queue,), name="job-events", daemon=True).start()
+        return _job_executor
+
+def _reset_job_executor(broken_executor):
+    # A worker died (e.g. OOM-killed). The pool is unusable from then on, so start a fresh one.
+    global _job_executor
+    with _job_executor_lock:
+        if _job_executor is broken_executor:
+            _job_executor = None
+    broken_executor.shutdown(wait=False, cancel_futures=True)
+
+def _prune_finished_jobs():
+    cutoff = time.time() - app.config['JOB_RETENTION_SECONDS']
+    with _jobs_lock:
+        expired = [jid for jid, job in _jobs.items() if job['finished_at'] and job['finished_at'] < cutoff]
+        for job_id in expired:
+            del _jobs[job_id]
+    for job_id in expired:
+        cleanup_files(*_job_record_paths(job_id))
+
+def _finish_job(job_id, future, cleanup_paths, on_success, on_done):
+    output_path = None
+    details = None
+    cancelled = False
+    try:
+        result = future.result()
+        success, message, output_path = result[:3]
+        details = result[3] if len(result) > 3 else None # e.g. merge stats
+    except BrokenProcessPool as e:
+        success, message = False, "The conversion worker crashed. The file may be too large or malformed."
+        app.logger.error(f"Job {job_id} lost its worker: {e}")
+    except CancelledError: # Cancelled here, or via a marker from another web process
+        success, message, cancelled = False, "Job cancelled.", True
+    except Exception as e:
+        success, message = False, f"An unexpected server error occurred: {str(e)}"
+        app.logger.error(f"Job {job_id} failed: {e}", exc_info=True)
+    cleanup_files(*cleanup_paths) # Always cleanup uploaded inputs
+    cleanup_files(_job_record_paths(job_id)[1])
+    if on_done:
+        on_done()
+    if success and on_success:
+        on_success(output_path)
+
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            cleanup_files(output_path if success else None)
+            return
+        job['status'] = 'finished' if success else ('cancelled' if cancelled else 'failed')
+        job['progress'] = 1.0
+        job['finished_at'] = time.time()
+        job['details'] = details
+        if success:
+            job['message'] = message
+            job['filename'] = os.path.basename(output_path)
+        else:
+            job['error'] = message
+        _save_job_record(job)
+
+def submit_job(kind, func, *args, cleanup_paths=(), on_success=None, on_done=None):
+    # Returns the new job id, or None when the pending queue is full (caller should answer 503).
+    # func must be a module-level function so it can be pickled over to the worker.
+    # on_success(output_path) runs in this process once the job has succeeded, on_done() once it has
+    # ended in any way (e.g. to release its admission ticket).
+    _prune_finished_jobs()
+    job_id = uuid.uuid4().hex
+    with _jobs_lock:
+        pending = sum(1 for job in _jobs.values() if job['status'] in ('queued', 'running'))
+        if pending >= app.config['JOB_MAX_PENDING']:
+            return None
+        _jobs[job_id] = {'id': job_id, 'kind': kind, 'status': 'queued', 'progress': 0.0,
+                         'message': "Waiting for a free worker...", 'error': None, 'filename': None,
+                         'details': None, 'created_at': time.time(), 'finished_at': None, 'future': None}
+        _save_job_record(_jobs[job_id])
+
+    for attempt in range(2):
+        executor = get_job_executor()
+        try:
+            future = executor.submit(_run_job, job_id, func, args)
+            break
+        except BrokenProcessPool:
+            _reset_job_executor(executor)
+            if attempt:
+                with _jobs_lock: del _jobs[job_id]
+                cleanup_files(*_job_record_paths(job_id))
+                raise
+
+    with _jobs_lock:
+        _jobs[job_id]['future'] = future
+    future.add_done_callback(lambda f: _finish_job(job_id, f, cleanup_paths, on_success, on_done))
+    return job_id
+
+def job_to_json(job):
+    data = {k: v for k, v in job.items() if k != 'future'}
+    if job['filename']:
+        data['download_url'] = url_for('download_file_route', filename=job['filename'])
+    return data
+
+def wants_async():
+    return request.form.get('async', request.args.get('async', '')).lower() in ('1', 'true', 'yes')
+
+def job_accepted_response(job_id, message):
+    return jsonify(success=True, job_id=job_id, message=message,
+                   status_url=url_for('job_status_route', job_id=job_id)), 202
+
+def job_queue_full_response():
+    response = jsonify(success=False, error="The server is busy with other conversions. Please try again shortly.")
+    response.headers['Retry-After'] = str(admission.retry_after())
+    return response, 503
+
+
+# --- Admission Control ---
+# Every conversion, merge, batch and pipeline is priced before it runs, from cheap metadata only:
+# the PDF page count and page size (PyPDF2 reads the page tree, nothing is rendered), the slide count
+# (python-pptx) and image dimensions (Pillow reads the header). The estimate is a rough
+# (CPU-seconds, bytes of peak memory) pair. Work is admitted while the estimates in flight fit a
+# global budget and each client's share of it. Otherwise the request waits in a bounded FIFO for
+# at most ADMISSION_QUEUE_TIMEOUT_SECONDS, and if that fails it gets a 503 with a Retry-After
+# derived from the outstanding work. Under overload, requests fail fast with a hint instead of piling up behind
+# the job pool, so latency for admitted work stays bounded by roughly budget / workers.
+app.config['ADMISSION_ENABLED'] = os.environ.get("FILEPRO_ADMISSION_ENABLED", "1").lower() in ('1', 'true', 'yes')
+app.config['ADMISSION_CPU_SECONDS'] = float(os.environ.get("FILEPRO_ADMISSION_CPU_SECONDS", app.config['JOB_WORKERS'] * 60))
+# Budgets are tracked per web process. The defaults split the machine between WEB_WORKERS processes
+# (the CPU budget via JOB_WORKERS), so the deployment as a whole stays within them.
+app.config['ADMISSION_MEMORY_BYTES'] = int(os.environ.get("FILEPRO_ADMISSION_MEMORY_BYTES", 2 * 1024 * 1024 * 1024 // app.config['WEB_WORKERS']))
+app.config['ADMISSION_CLIENT_SHARE'] = float(os.environ.get("FILEPRO_ADMISSION_CLIENT_SHARE", 0.5)) # Of each budget
+app.config['ADMISSION_QUEUE_MAX'] = int(os.environ.get("FILEPRO_ADMISSION_QUEUE_MAX", 16))
+app.config['ADMISSION_QUEUE_TIMEOUT_SECONDS'] = float(os.environ.get("FILEPRO_ADMISSION_QUEUE_TIMEOUT_SECONDS", 5))
+app.config['ADMISSION_TRUST_FORWARDED'] = os.environ.get("FILEPRO_ADMISSION_TRUST_FORWARDED", "0").lower() in ('1', 'true', 'yes')
+MAX_RETRY_AFTER_SECONDS = 300
+
+# Rough per-unit costs, in the ballpark of benchmark.py on one modern core. They only need to rank
+# and sum jobs sensibly, not predict them exactly.
+COST_BASE = (0.05, 40 * 1024 * 1024) # Any conversion: backend setup and the interpreter's working set
+COST_PDF_RENDER_PAGE_CPU = 0.25 # Per page at DEFAULT_RENDER_DPI, scales with dpi squared
+COST_PDF_DOCX_PAGE = (0.6, 2 * 1024 * 1024) # Per page, plus one pdf2docx/PyMuPDF working set per process
+COST_PDF_DOCX_PROCESS_BYTES = 150 * 1024 * 1024
+COST_PPTX_SLIDE = (0.03, 1024 * 1024)
+COST_DOCX_TO_PDF = (10.0, 300 * 1024 * 1024) # Word / LibreOffice via docx2pdf, not introspectable
+COST_IMAGE_PIXEL_CPU = 3e-8 # Decode + resample + encode
+COST_MERGE_PAGE_CPU = 0.01
+COST_FALLBACK_PER_MB = (1.0, 10 * 1024 * 1024) # When the metadata can't be read
+COST_BYTES_PER_PAGE_GUESS = 50 * 1024 # Page count of DOCX files and unreadable inputs
+
+metrics.describe('filepro_admission_decisions_total', 'counter', "Admission decisions by outcome.")
+metrics.describe('filepro_admission_wait_seconds', 'histogram', "Time requests waited for admission.", LATENCY_BUCKETS)
+metrics.describe('filepro_admission', 'gauge', "Admission controller state: estimated work in flight and waiting requests.")
+
+def _pdf_metadata(path):
+    # Returns (page_count, (width, height) of the first page in points).
+    load_backend('pypdf2')
+    from PyPDF2 import PdfReader
+    with open(path, 'rb') as pdf_file: # From a path, PdfReader would read the whole file into memory
+        reader = PdfReader(pdf_file)
+        page_count = len(reader.pages)
+        if not page_count:
+            return 0, (612, 792)
+        box = reader.pages[0].mediabox
+        return page_count, (abs(float(box.width)), abs(float(box.height)))
+
+def document_profile(ext, path):
+    # What the cost models need to know about a file: {'pages', 'page_size' (points), 'pixels', 'is_jpeg',
+    # 'bytes'}, from metadata only. Unreadable files get a profile guessed from their size and marked
+    # 'unreadable', so they're priced by size and the converter reports the actual problem when it runs.
+    size = _total_file_size(path)
+    profile = {'pages': 1, 'page_size': (612, 792), 'pixels': None, 'is_jpeg': False, 'bytes': size}
+    try:
+        if ext == 'pdf':
+            profile['pages'], profile['page_size'] = _pdf_metadata(path)
+        elif ext == 'pptx':
+            load_backend('python-pptx')
+            from pptx import Presentation
+            prs = Presentation(path)
+            profile['pages'] = len(prs.slides)
+            profile['page_size'] = (prs.slide_width / EMU_PER_POINT, prs.slide_height / EMU_PER_POINT)
+        elif ext == 'docx': # Page count isn't known without laying it out
+            profile['pages'] = max(1, -(-size // COST_BYTES_PER_PAGE_GUESS))
+        elif ext in IMAGE_EXTENSIONS:
+            load_backend('pillow')
+            from PIL import Image
+            with Image.open(path) as img: # Reads the header only
+                profile['pixels'], profile['is_jpeg'] = (img.width, img.height), img.format == 'JPEG'
+    except Exception as e:
+        app.logger.debug(f"Cost estimate for {path} falls back to its size: {e}")
+        profile.update(pages=max(1, -(-size // COST_BYTES_PER_PAGE_GUESS)), unreadable=True)
+    return profile
+
+def _reduced_pixels(pixels, max_dimension=None):
+    width, height = pixels
+    if max_dimension and max(width, height) > max_dimension:
+        scale = max_dimension / max(width, height)
+        return max(1, round(width * scale)), max(1, round(height * scale))
+    return width, height
+
+def _selected_page_count(page_count, options):
+    if options.get('pages'):
+        return len(parse_page_ranges(options['pages'], page_count))
+    first = options.get('first_page') or options.get('start') or 1
+    last = min(options.get('last_page') or options.get('end') or page_count, page_count)
+    return max(0, last - first + 1)
+
+def _profile_cost(input_ext, target_format, profile, options):
+    # Returns (cpu_seconds, memory_bytes) for converting a file with this profile. Never raises.
+    cpu, memory = COST_BASE
+    try:
+        if profile.get('unreadable'):
+            raise ValueError("unreadable input")
+        if input_ext == 'pdf' and target_format == 'images':
+            width_pt, height_pt = profile['page_size']
+            scale = (options.get('dpi') or DEFAULT_RENDER_DPI) / 72
+            page_bytes = width_pt * scale * height_pt * scale * 3 # RGB raster, plus its PNG, per page in the window
+            cpu += _selected_page_count(profile['pages'], options) * COST_PDF_RENDER_PAGE_CPU * (scale * 72 / DEFAULT_RENDER_DPI) ** 2
+            memory += page_bytes * 2 * max(1, app.config['PDF_RENDER_WINDOW'])
+        elif input_ext == 'pdf' and target_format == 'docx':
+            page_count = _selected_page_count(profile['pages'], options)
+            processes = 1
+            if page_count >= app.config['PDF2DOCX_PARALLEL_MIN_PAGES']:
+                segments = -(-page_count // max(1, app.config['PDF2DOCX_PAGES_PER_SEGMENT']))
+                processes = max(1, min(app.config['PDF2DOCX_WORKERS'], segments))
+            cpu += page_count * COST_PDF_DOCX_PAGE[0]
+            memory += page_count * COST_PDF_DOCX_PAGE[1] + processes * COST_PDF_DOCX_PROCESS_BYTES
+        elif input_ext == 'pptx':
+            cpu += profile['pages'] * COST_PPTX_SLIDE[0]
+            memory += profile['pages'] * COST_PPTX_SLIDE[1] + profile['bytes'] * 2
+        elif input_ext == 'docx':
+            cpu, memory = cpu + COST_DOCX_TO_PDF[0], memory + COST_DOCX_TO_PDF[1]
+        elif input_ext in IMAGE_EXTENSIONS:
+            width, height = profile['pixels']
+            pixels = width * height
+            output_width, output_height = _reduced_pixels(profile['pixels'], options.get('max_dimension'))
+            output_pixels = output_width * output_height
+            if profile['is_jpeg'] and output_pixels < pixels: # Decoded via draft(), at most 2x the target size per side (see open_image_reduced)
+                pixels = min(pixels, output_pixels * 4)
+            cpu += pixels * COST_IMAGE_PIXEL_CPU
+            memory += (pixels + output_pixels) * 4
+        else:
+            raise ValueError(f"no cost model for .{input_ext} to .{target_format}")
+    except Exception:
+        size_mb = profile['bytes'] / (1024 * 1024)
+        return COST_BASE[0] + size_mb * COST_FALLBACK_PER_MB[0], COST_BASE[1] + size_mb * COST_FALLBACK_PER_MB[1]
+    return cpu, memory
+
+def _converted_profile(input_ext, target_format, profile, options):
+    # Profile of a conversion's planned output, for pricing the pipeline steps after it.
+    if input_ext == target_format or profile.get('unreadable'):
+        return profile
+    converted = dict(profile)
+    try:
+        page_count = _selected_page_count(profile['pages'], options)
+    except ValueError:
+        page_count = profile['pages']
+    if input_ext == 'pdf' and target_format == 'images':
+        scale = (options.get('dpi') or DEFAULT_RENDER_DPI) / 72
+        width_pt, height_pt = profile['page_size']
+        converted.update(pages=page_count, pixels=(round(width_pt * scale), round(height_pt * scale)), is_jpeg=False)
+    elif input_ext == 'pdf':
+        converted['pages'] = page_count
+    elif input_ext in IMAGE_EXTENSIONS:
+        width, height = _reduced_pixels(profile['pixels'], options.get('max_dimension'))
+        converted.update(pixels=(width, height), is_jpeg=target_format in ('jpg', 'jpeg'))
+        if target_format == 'pdf':
+            converted['page_size'] = (width * 72 / 96, height * 72 / 96) # img2pdf's default of 96 DPI
+    return converted
+
+def estimate_conversion_cost(input_ext, target_format, input_path, options=None):
+    # Returns (cpu_seconds, memory_bytes) for one conversion. Never raises: unreadable inputs are
+    # priced by size, and the converter reports the actual problem when it runs.
+    return _profile_cost(input_ext, target_format, document_profile(input_ext, input_path), options or {})
+
+def _merge_cost(merge_type, exts, profiles, merge_mode='standard', image_options=None):
+    cpu, memory = COST_BASE
+    if merge_type == 'images':
+        for ext, profile in zip(exts, profiles):
+            image_cpu, image_memory = _profile_cost(ext, 'pdf', profile, image_options or {})
+            cpu += image_cpu
+            memory = max(memory, image_memory) # One image is decoded at a time
+        return cpu, memory
+    input_bytes = sum(profile['bytes'] for profile in profiles)
+    if merge_type == 'pdf':
+        for profile in profiles:
+            if profile.get('unreadable'):
+                cpu += profile['bytes'] / (1024 * 1024) * COST_FALLBACK_PER_MB[0]
+            else:
+                cpu += profile['pages'] * COST_MERGE_PAGE_CPU
+        # The standard engine holds every input's object graph, the incremental one about one input's worth
+        return cpu, memory + (input_bytes * 3 if merge_mode == 'standard' else input_bytes)
+    return cpu + input_bytes / (1024 * 1024) * 0.5, memory + input_bytes * 10 # DOCX: XML trees in memory
+
+def _merged_profile(merge_type, profiles, page_ranges=None):
+    merged = {'pages': 0, 'page_size': profiles[0]['page_size'], 'pixels': None, 'is_jpeg': False,
+              'bytes': sum(profile['bytes'] for profile in profiles)}
+    for index, profile in enumerate(profiles):
+        page_count = profile['pages']
+        if page_ranges and page_ranges[index]:
+            try:
+                page_count = len(parse_page_ranges(page_ranges[index], page_count))
+            except ValueError:
+                pass
+        merged['pages'] += page_count
+    return merged
+
+def estimate_merge_cost(merge_type, input_paths, merge_mode='standard', image_options=None):
+    exts = [get_file_ext(path) for path in input_paths]
+    return _merge_cost(merge_type, exts, [document_profile(ext, path) for ext, path in zip(exts, input_paths)],
+                       merge_mode, image_options)
+
+def estimate_pipeline_cost(items, steps):
+    # Only the inputs exist up front. Their profiles are carried through the planned steps (each step's
+    # 'input_exts' from plan_pipeline, page counts and page sizes from the conversions and merges before
+    # it), so a late step is priced on what it will actually get, e.g. a 600-DPI render of a converted deck.
+    cpu, memory = COST_BASE
+    profiles = [document_profile(item['ext'], item['path']) for item in items]
+    for step in steps:
+        exts = step['input_exts']
+        if step['op'] == 'convert':
+            for index, (ext, profile) in enumerate(zip(exts, profiles)):
+                options = step['options'].get(ext, {})
+                if ext != step['to']:
+                    step_cpu, step_memory = _profile_cost(ext, step['to'], profile, options)
+                    cpu, memory = cpu + step_cpu, max(memory, step_memory)
+                profiles[index] = _converted_profile(ext, step['to'], profile, options)
+        else:
+            step_cpu, step_memory = _merge_cost(step['to'], exts, profiles, step['mode'], step['image_options'])
+            cpu, memory = cpu + step_cpu, max(memory, step_memory)
+            profiles = [_merged_profile(step['to'], profiles, step['page_ranges'])]
+    return cpu, memory
+
+def client_identity():
+    # Budgets are per client address. Behind a trusted proxy, use the original client from X-Forwarded-For.
+    if app.config['ADMISSION_TRUST_FORWARDED'] and request.access_route:
+        return request.access_route[0]
+    return request.remote_addr or 'unknown'
+
+class AdmissionController:
+    def __init__(self, cpu_budget, memory_budget, client_share, queue_max, queue_timeout, workers, enabled=True):
+        self.cpu_budget = cpu_budget
+        self.memory_budget = memory_budget
+        self.client_share = client_share
+        self.queue_max = queue_max
+        self.queue_timeout = queue_timeout
+        self.workers = max(1, workers)
+        self.enabled = enabled
+        self._cond = threading.Condition()
+        self._in_flight = {} # ticket -> (client, cpu_seconds, memory_bytes, admitted_at)
+        self._waiting = [] # [(client, cpu_seconds, memory_bytes)], oldest first
+        self.admitted = 0
+        self.rejected = 0
+
+    def _fits(self, client, cpu, memory):
+        if not self._in_flight:
+            return True # An idle server takes any single job, or an oversized one could never run
+        total_cpu = total_memory = client_cpu = client_memory = 0
+        for owner, owned_cpu, owned_memory, _ in self._in_flight.values():
+            total_cpu += owned_cpu
+            total_memory += owned_memory
+            if owner == client:
+                client_cpu += owned_cpu
+                client_memory += owned_memory
+        if total_cpu + cpu > self.cpu_budget or total_memory + memory > self.memory_budget:
+            return False
+        if client_cpu and (client_cpu + cpu > self.cpu_budget * self.client_share
+                           or client_memory + memory > self.memory_budget * self.client_share):
+            return False # A client's first job only has to fit the global budget
+        return True
+
+    def admit(self, client, cpu, memory):
+        # Returns a ticket to release() once the work is done, or None when the caller should answer 503.
+        # Waiters are served oldest first, except that one that doesn't fit yet doesn't hold back later
+        # ones that do; the wait timeout keeps that from starving large jobs indefinitely.
+        if not self.enabled:
+            return object()
+        started = time.monotonic()
+        with self._cond:
+            if not self._waiting and self._fits(client, cpu, memory):
+                return self._reserve(client, cpu, memory, 'admitted', started)
+            if len(self._waiting) >= self.queue_max:
+                return self._reject('queue_full')
+            request_entry = (client, cpu, memory)
+            self._waiting.append(request_entry)
+            deadline = started + self.queue_timeout
+            try:
+                while True:
+                    position = self._waiting.index(request_entry)
+                    if self._fits(client, cpu, memory) and not any(self._fits(*earlier) for earlier in self._waiting[:position]):
+                        self._waiting.pop(position)
+                        self._cond.notify_all() # Later waiters may fit as well
+                        return self._reserve(client, cpu, memory, 'queued', started)
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return self._reject('timeout')
+                    self._cond.wait(remaining)
+            finally:
+                if request_entry in self._waiting:
+                    self._waiting.remove(request_entry)
+                    self._cond.notify_all()
+
+    def _reserve(self, client, cpu, memory, outcome, started):
+        ticket = object()
+        self._in_flight[ticket] = (client, cpu, memory, time.monotonic())
+        self.admitted += 1
+        metrics.inc('filepro_admission_decisions_total', outcome=outcome)
+        metrics.observe('filepro_admission_wait_seconds', time.monotonic() - started)
+        return ticket
+
+    def _reject(self, reason):
+        self.rejected += 1
+        metrics.inc('filepro_admission_decisions_total', outcome=f"rejected_{reason}")
+        return None
+
+    def release(self, ticket):
+        with self._cond:
+            if self._in_flight.pop(ticket, None) is not None:
+                self._cond.notify_all()
+
+    def retry_after(self):
+        # Seconds until the estimated outstanding work has drained through the workers.
+        now = time.monotonic()
+        with self._cond:
+            outstanding = sum(max(cpu - (now - admitted_at), 0) for _, cpu, _, admitted_at in self._in_flight.values())
+            outstanding += sum(cpu for _, cpu, _ in self._waiting)
+        return int(min(max(outstanding / self.workers, 1), MAX_RETRY_AFTER_SECONDS) + 0.999)
+
+    def stats(self):
+        with self._cond:
+            return {'enabled': self.enabled, 'in_flight': len(self._in_flight), 'waiting': len(self._waiting),
+                    'cpu_seconds': round(sum(entry[1] for entry in self._in_flight.values()), 3),
+                    'memory_bytes': int(sum(entry[2] for entry in self._in_flight.values())),
+                    'cpu_seconds_budget': self.cpu_budget, 'memory_bytes_budget': self.memory_budget,
+                    'admitted': self.admitted, 'rejected': self.rejected}
+
+admission = AdmissionController(app.config['ADMISSION_CPU_SECONDS'], app.config['ADMISSION_MEMORY_BYTES'],
+                                app.config['ADMISSION_CLIENT_SHARE'], app.config['ADMISSION_QUEUE_MAX'],
+                                app.config['ADMISSION_QUEUE_TIMEOUT_SECONDS'], app.config['JOB_WORKERS'],
+                                enabled=app.config['ADMISSION_ENABLED'])
+
+def admit_request(estimate, *args):
+    # Prices the work with estimate(*args) -> (cpu_seconds, memory_bytes) and asks for admission.
+    # Returns a ticket for admission.release(), or None (answer with job_queue_full_response()).
+    with track_stage('admission'):
+        return admission.admit(client_identity(), *estimate(*args))
+
+
+# --- Conversion Result Cache ---
+# Content-addressed: the key is a hash of the uploaded bytes plus the target format and options,
+# so re-uploading the same document costs one hash pass instead of a full conversion.
+# Cached artifacts live in CONVERTED_FOLDER like any other result. The index is per process.
+app.config['RESULT_CACHE_MAX_BYTES'] = int(os.environ.get("FILEPRO_RESULT_CACHE_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+IO_CHUNK_SIZE = 1024 * 1024
+
+def save_upload_hashed(file_storage, destination_path):
+    # Same as FileStorage.save(), but hashes the bytes on the way through. Returns the sha256 hex digest.
+    digest = hashlib.sha256()
+    with open(destination_path, 'wb') as out:
+        while True:
+            chunk = file_storage.stream.read(IO_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            out.write(chunk)
+    return digest.hexdigest()
+
+def conversion_cache_key(input_digest, input_ext, target_format, options=None):
+    options_part = json.dumps(options or {}, sort_keys=True)
+    return hashlib.sha256(f"{input_digest}|{input_ext}|{target_format}|{options_part}".encode()).hexdigest()
+
+class ConversionResultCache:
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # key -> (filename, size), least recently used first
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        # Returns the cached artifact's filename, or None on a miss.
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and os.path.exists(os.path.join(self.folder, entry[0])):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry: # Artifact was removed behind our back (e.g. by cleanup)
+                self._drop(key)
+            self.misses += 1
+            return None
+
+    def put(self, key, artifact_path):
+        try:
+            size = os.path.getsize(artifact_path)
+        except OSError:
+            return
+        if size > self.max_bytes:
+            return # Would evict everything else and still not fit
+        evicted = []
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (os.path.basename(artifact_path), size)
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes:
+                old_key = next(iter(self._entries))
+                evicted.append(self._entries[old_key][0])
+                self._drop(old_key)
+                self.evictions += 1
+        cleanup_files(*(os.path.join(self.folder, filename) for filename in evicted))
+
+    def _drop(self, key):
+        _, size = self._entries.pop(key)
+        self._total_bytes -= size
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self._entries), 'bytes': self._total_bytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0}
+
+conversion_cache = ConversionResultCache(CONVERTED_FOLDER, app.config['RESULT_CACHE_MAX_BYTES'])
+
+
+# --- Storage Janitor ---
+# Background thread that enforces a TTL per folder and a total byte quota over uploads/ and converted/.
+# Each tick stats at most JANITOR_SCAN_BATCH entries, so a pass over 100k+ files is spread out
+# instead of stalling. Once a pass completes, the oldest files are evicted until usage is under quota.
+app.config['CONVERTED_RETENTION_SECONDS'] = int(os.environ.get("FILEPRO_CONVERTED_RETENTION_SECONDS", 24 * 3600))
+app.config['UPLOAD_RETENTION_SECONDS'] = int(os.environ.get("FILEPRO_UPLOAD_RETENTION_SECONDS", 2 * 3600)) # Orphans from crashed requests
+app.config['STORAGE_QUOTA_BYTES'] = int(os.environ.get("FILEPRO_STORAGE_QUOTA_BYTES", 10 * 1024 * 1024 * 1024))
+app.config['JANITOR_ENABLED'] = os.environ.get("FILEPRO_JANITOR", "1").lower() not in ('0', 'false', 'no')
+app.config['JANITOR_INTERVAL_SECONDS'] = float(os.environ.get("FILEPRO_JANITOR_INTERVAL_SECONDS", 5))
+app.config['JANITOR_SCAN_BATCH'] = int(os.environ.get("FILEPRO_JANITOR_SCAN_BATCH", 2000))
+app.config['JANITOR_MIN_AGE_SECONDS'] = int(os.environ.get("FILEPRO_JANITOR_MIN_AGE_SECONDS", 300)) # Never evict files this fresh for quota
+
+def _path_size(path, is_dir):
+    if not is_dir:
+        return os.path.getsize(path)
+    total = 0
+    for root, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(root, filename))
+            except OSError:
+                pass
+    return total
+
+class StorageJanitor:
+    def __init__(self, folder_ttls, quota_bytes, scan_batch, min_age_seconds):
+        self.folder_ttls = folder_ttls # folder -> retention in seconds
+        self.quota_bytes = quota_bytes
+        self.scan_batch = scan_batch
+        self.min_age_seconds = min_age_seconds
+        self._index = {} # path -> (size, mtime, is_dir), as of the last time we saw it
+        self._seen = set()
+        self._scan = None
+        self._pass_started = None
+        self._lock = threading.Lock()
+        self._stats = {'passes': 0, 'expired_deleted': 0, 'quota_deleted': 0, 'bytes_reclaimed': 0,
+                       'last_pass_seconds': None, 'last_pass_finished_at': None}
+
+    def _iter_entries(self):
+        for folder, ttl in self.folder_ttls.items():
+            try:
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        yield entry, ttl
+            except FileNotFoundError:
+                continue
+
+    def _delete(self, path, size):
+        cleanup_files(path)
+        if os.path.exists(path):
+            return False
+        self._index.pop(path, None)
+        self._stats['bytes_reclaimed'] += size
+        return True
+
+    def tick(self):
+        # Processes one batch of directory entries. Returns True when a full pass has just completed.
+        with self._lock:
+            if self._scan is None:
+                self._scan = self._iter_entries()
+                self._seen = set()
+                self._pass_started = time.monotonic()
+            now = time.time()
+            for _ in range(self.scan_batch):
+                try:
+                    entry, ttl = next(self._scan)
+                except StopIteration:
+                    self._finish_pass()
+                    return True
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    mtime = entry.stat(follow_symlinks=False).st_mtime
+                    known = self._index.get(entry.path)
+                    # Only re-walk directories whose mtime changed since we last sized them
+                    size = known[0] if known and known[1] == mtime else _path_size(entry.path, is_dir)
+                except OSError:
+                    continue # Vanished between scandir and stat
+                if now - mtime > ttl:
+                    if self._delete(entry.path, size):
+                        self._stats['expired_deleted'] += 1
+                        continue
+                self._index[entry.path] = (size, mtime, is_dir)
+                self._seen.add(entry.path)
+            return False
+
+    def _finish_pass(self):
+        for path in [p for p in self._index if p not in self._seen]:
+            del self._index[path] # Removed by someone else since the last pass
+        self._enforce_quota()
+        self._scan = None
+        self._seen = set()
+        self._stats['passes'] += 1
+        self._stats['last_pass_seconds'] = round(time.monotonic() - self._pass_started, 3)
+        self._stats['last_pass_finished_at'] = time.time()
+
+    def _enforce_quota(self):
+        total = sum(size for size, _, _ in self._index.values())
+        if total <= self.quota_bytes:
+            return
+        cutoff = time.time() - self.min_age_seconds
+        oldest_first = [(mtime, path, size) for path, (size, mtime, _) in self._index.items() if mtime < cutoff]
+        heapq.heapify(oldest_first)
+        while total > self.quota_bytes and oldest_first:
+            _, path, size = heapq.heappop(oldest_first)
+            if self._delete(path, size):
+                total -= size
+                self._stats['quota_deleted'] += 1
+        if total > self.quota_bytes:
+            app.logger.warning(f"Storage is over quota ({total} > {self.quota_bytes} bytes) with only recent files left.")
+
+    def stats(self):
+        with self._lock:
+            usage = {}
+            for folder in self.folder_ttls:
+                prefix = os.path.join(folder, '')
+                sizes = [size for path, (size, _, _) in self._index.items() if path.startswith(prefix)]
+                usage[os.path.basename(folder)] = {'files': len(sizes), 'bytes': sum(sizes)}
+            return dict(self._stats, quota_bytes=self.quota_bytes, scan_in_progress=self._scan is not None,
+                        usage=usage, total_bytes=sum(u['bytes'] for u in usage.values()))
+
+    def run_forever(self, interval_seconds):
+        while True:
+            try:
+                pass_done = self.tick()
+            except Exception as e:
+                app.logger.error(f"Storage janitor error: {e}", exc_info=True)
+                pass_done = True
+            # Keep scanning straight away mid-pass; rest between passes
+            time.sleep(interval_seconds if pass_done else 0.05)
+
+storage_janitor = StorageJanitor({CONVERTED_FOLDER: app.config['CONVERTED_RETENTION_SECONDS'],
+                                  UPLOAD_FOLDER: app.config['UPLOAD_RETENTION_SECONDS']},
+                                 app.config['STORAGE_QUOTA_BYTES'], app.config['JANITOR_SCAN_BATCH'],
+                                 app.config['JANITOR_MIN_AGE_SECONDS'])
+_janitor_thread = None
+_janitor_thread_lock = threading.Lock()
+
+@app.before_request
+def start_storage_janitor():
+    # Started lazily on the first request, so it runs in the serving process rather than a pre-fork master.
+    global _janitor_thread
+    if _janitor_thread is not None or not app.config['JANITOR_ENABLED']:
+        return
+    with _janitor_thread_lock:
+        if _janitor_thread is None:
+            _janitor_thread = threading.Thread(target=storage_janitor.run_forever, args=(app.config['JANITOR_INTERVAL_SECONDS'],),
+                                               name="storage-janitor", daemon=True)
+            _janitor_thread.start()
+
+
+# --- Chunked Uploads ---
+# init -> append chunks -> finalize. Each chunk is streamed from the request body straight into
+# the final file (no Werkzeug spool, no second copy) and hashed on the way while the chunks keep
+# reaching the same web process (otherwise once at finalize), so the digest can feed the result cache. A dropped connection keeps the bytes already written: ask for the current
+# offset and continue from there. Chunks must each fit in MAX_CONTENT_LENGTH; the total may not exceed
+# CHUNKED_UPLOAD_MAX_BYTES. Finalized uploads are passed to /convert (upload_id) or /merge (upload_ids).
+app.config['CHUNKED_UPLOAD_MAX_BYTES'] = int(os.environ.get("FILEPRO_CHUNKED_UPLOAD_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+
+_upload_hashers = {} # upload_id -> (offset, sha256 object); per process, see _upload_hasher_at
+_upload_locks = {} # upload_id -> [lock, requests holding or waiting for it]
+_upload_registry_lock = threading.Lock()
+
+def _chunked_upload_paths(upload_id):
+    if not upload_id or len(upload_id) != 32 or any(ch not in '0123456789abcdef' for ch in upload_id):
+        return None, None
+    stem = os.path.join(app.config['UPLOAD_FOLDER'], f"chunked_{upload_id}")
+    return f"{stem}.part", f"{stem}.json"
+
+@contextmanager
+def _upload_lock(upload_id):
+    # Serializes this process's requests for one upload. Callers check that the upload exists first;
+    # the entry goes away with its last user, so unknown ids can't grow _upload_locks.
+    with _upload_registry_lock:
+        upload_lock = _upload_locks.setdefault(upload_id, [threading.Lock(), 0])
+        upload_lock[1] += 1
+    try:
+        with upload_lock[0]:
+            yield
+    finally:
+        with _upload_registry_lock:
+            upload_lock[1] -= 1
+            if not upload_lock[1]:
+                del _upload_locks[upload_id]
+
+def _chunked_upload_exists(upload_id):
+    # Cheap check before taking the lock. Drops the hasher of uploads that were aborted or expired.
+    _, meta_path = _chunked_upload_paths(upload_id)
+    if meta_path and os.path.exists(meta_path):
+        return True
+    _upload_hashers.pop(upload_id, None)
+    return False
+
+def _prune_upload_hashers():
+    # Uploads abandoned by their client are deleted by the janitor; forget their hashers too.
+    for upload_id in list(_upload_hashers):
+        _chunked_upload_exists(upload_id)
+
+def load_chunked_upload(upload_id):
+    # Returns the upload's metadata (with the current byte count as 'received'), or None if unknown.
+    data_path, meta_path = _chunked_upload_paths(upload_id)
+    if not data_path:
+        return None
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        meta['received'] = os.path.getsize(data_path)
+    except (OSError, ValueError):
+        return None
+    return meta
+
+def _save_chunked_upload_meta(upload_id, meta):
+    _, meta_path = _chunked_upload_paths(upload_id)
+    with open(meta_path, 'w') as f:
+        json.dump({k: v for k, v in meta.items() if k != 'received'}, f)
+
+def _upload_hasher_at(upload_id, offset):
+    # The running hasher, if this process has consumed exactly `offset` bytes of the upload, else None.
+    # Chunks can land on different web workers; rebuilding the hasher from disk for every chunk would
+    # re-read the whole partial file each time, so the upload is instead hashed once at finalize.
+    state = _upload_hashers.pop(upload_id, None)
+    return state[1] if state and state[0] == offset else None
+
+def _hash_file(data_path):
+    digest = hashlib.sha256()
+    with open(data_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(IO_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest
+
+def claim_chunked_upload(upload_id, destination_path):
+    # Moves a finalized upload to destination_path (a rename, not a copy). Returns its sha256, or None.
+    data_path, meta_path = _chunked_upload_paths(upload_id)
+    with _upload_lock(upload_id):
+        meta = load_chunked_upload(upload_id)
+        if not meta or not meta.get('finalized'):
+            return None
+        try:
+            os.replace(data_path, destination_path)
+        except OSError:
+            return None # Claimed by someone else in the meantime
+        cleanup_files(meta_path)
+    return meta['sha256']
+
+def chunked_upload_to_json(upload_id, meta):
+    return {'upload_id': upload_id, 'filename': meta['filename'], 'received': meta['received'],
+            'total_size': meta['total_size'], 'finalized': meta['finalized'], 'sha256': meta.get('sha256'),
+            'chunk_url': url_for('append_chunk_route', upload_id=upload_id)}
+
+
+# --- Downloads ---
+# Artifacts are served with a strong ETag and Last-Modified. Conditional GETs are answered here and
+# byte ranges are honoured, so interrupted downloads can resume. With an offload mode, the response
+# only carries headers and the front proxy sends the file itself, keeping Python workers free:
+#   x-accel    (nginx)            X-Accel-Redirect: <DOWNLOAD_ACCEL_PREFIX><filename>, which must map to
+#                                 CONVERTED_FOLDER in an `internal` location
+#   x-sendfile (Apache, lighttpd) X-Sendfile: <absolute path>
+# The proxy then handles Range itself.
+app.config['DOWNLOAD_OFFLOAD'] = os.environ.get("FILEPRO_DOWNLOAD_OFFLOAD", "none").lower() # none | x-accel | x-sendfile
+app.config['DOWNLOAD_ACCEL_PREFIX'] = os.environ.get("FILEPRO_DOWNLOAD_ACCEL_PREFIX", "/_protected/converted/")
+
+def artifact_etag(stat_result):
+    # Artifacts are written once under a unique name and never modified in place, so inode, size and
+    # mtime identify the content without hashing it (the same scheme nginx uses).
+    return f"{stat_result.st_ino:x}-{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"
+
+def offloaded_download_response(path, download_name, stat_result):
+    mode = app.config['DOWNLOAD_OFFLOAD']
+    response = Response(mimetype=mimetypes.guess_type(download_name)[0] or 'application/octet-stream')
+    response.headers.set('Content-Disposition', 'attachment', filename=download_name)
+    response.set_etag(artifact_etag(stat_result))
+    response.last_modified = stat_result.st_mtime
+    response.cache_control.no_cache = True
+    response = response.make_conditional(request.environ) # 304 / 412 without touching the proxy
+    if response.status_code == 200:
+        if mode == 'x-accel':
+            response.headers['X-Accel-Redirect'] = app.config['DOWNLOAD_ACCEL_PREFIX'] + quote(download_name)
+        else:
+            response.headers['X-Sendfile'] = os.path.abspath(path)
+    return response
+
+
+# --- Page Previews ---
+# POST /preview stores a PDF once per content hash (UPLOAD_FOLDER/preview_<sha256>.pdf) and returns its
+# id. Single pages and thumbnail strips are then rendered on demand at low DPI, via poppler's first/last page
+# range, so previewing page 400 of a 500-page document never rasterizes the other 499.
+# Rendered PNGs live in a per-process LRU keyed by (document hash, page, dpi). The URLs are
+# content-addressed, so responses are immutable and browsers and proxies can cache them indefinitely.
+app.config['PREVIEW_CACHE_MAX_BYTES'] = int(os.environ.get("FILEPRO_PREVIEW_CACHE_MAX_BYTES", 128 * 1024 * 1024))
+app.config['PREVIEW_STRIP_MAX_PAGES'] = int(os.environ.get("FILEPRO_PREVIEW_STRIP_MAX_PAGES", 12))
+PREVIEW_DEFAULT_DPI = 48
+PREVIEW_MAX_DPI = 150
+PREVIEW_STRIP_GAP = 8 # Pixels between pages in a strip
+
+metrics.describe('filepro_preview_cache', 'gauge', "Page preview cache statistics.")
+
+class PreviewCache:
+    # Like ConversionResultCache, but the values are the PNG bytes themselves.
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # key -> png bytes, least recently used first
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, record=True):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            if record:
+                if data is not None:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= len(self._entries.pop(key))
+            self._entries[key] = data
+            self._total_bytes += len(data)
+            while self._total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= len(evicted)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self._entries), 'bytes': self._total_bytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0}
+
+preview_cache = PreviewCache(app.config['PREVIEW_CACHE_MAX_BYTES'])
+_preview_page_counts = OrderedDict() # document id -> page count, so bounds checks don't reopen the PDF
+_preview_render_locks = {} # document id -> [lock, requests holding or waiting for it], so concurrent requests render each page once
+_preview_lock = threading.Lock()
+
+def preview_document_path(doc_id):
+    # Returns the stored PDF's path, or None for a malformed id. Ids are sha256 hex digests.
+    if len(doc_id) != 64 or any(c not in '0123456789abcdef' for c in doc_id):
+        return None
+    return os.path.join(app.config['UPLOAD_FOLDER'], f"preview_{doc_id}.pdf")
+
+def preview_page_count(doc_id):
+    # Returns the page count, or None when the document isn't stored (never uploaded, or swept by the janitor).
+    path = preview_document_path(doc_id)
+    if path is None:
+        return None
+    if not os.path.exists(path): # Forget the cached count too, so the client gets a 404 and uploads again
+        with _preview_lock:
+            _preview_page_counts.pop(doc_id, None)
+        return None
+    with _preview_lock:
+        if doc_id in _preview_page_counts:
+            _preview_page_counts.move_to_end(doc_id)
+            return _preview_page_counts[doc_id]
+    page_count = _pdf_metadata(path)[0]
+    with _preview_lock:
+        _preview_page_counts[doc_id] = page_count
+        while len(_preview_page_counts) > 10000:
+            _preview_page_counts.popitem(last=False)
+    return page_count
+
+def store_preview_document(source_path, doc_id):
+    # Moves an uploaded PDF into place under its hash. Returns its page count; raises on unreadable PDFs.
+    path = preview_document_path(doc_id)
+    if os.path.exists(path):
+        cleanup_files(source_path)
+        os.utime(path) # Keep it clear of the janitor's upload TTL
+    else:
+        try:
+            page_count = _pdf_metadata(source_path)[0]
+        except Exception:
+            cleanup_files(source_path)
+            raise
+        os.replace(source_path, path)
+        with _preview_lock:
+            _preview_page_counts[doc_id] = page_count
+    return preview_page_count(doc_id)
+
+def _consecutive_runs(numbers):
+    # [1, 2, 3, 7, 8] -> (1, 3), (7, 8)
+    runs = []
+    for number in numbers:
+        if runs and runs[-1][1] == number - 1:
+            runs[-1][1] = number
+        else:
+            runs.append([number, number])
+    return [tuple(run) for run in runs]
+
+def render_preview_pages(doc_id, first, last, dpi):
+    # Returns {page_number: png_bytes} for first..last, rendering only the pages not cached yet.
+    # Each run of consecutive missing pages is one poppler call. Raises FileNotFoundError when pages
+    # are missing and the janitor has swept the document since the caller's preview_page_count().
+    pages = {}
+    for page_number in range(first, last + 1):
+        data = preview_cache.get((doc_id, page_number, dpi))
+        if data is not None:
+            pages[page_number] = data
+    if len(pages) == last - first + 1:
+        return pages
+    with _preview_lock:
+        render_lock = _preview_render_locks.setdefault(doc_id, [threading.Lock(), 0])
+        render_lock[1] += 1
+    try:
+        with render_lock[0]:
+            for page_number in range(first, last + 1): # Another request may have rendered them while we waited
+                data = pages.get(page_number) or preview_cache.get((doc_id, page_number, dpi), record=False)
+                if data is not None:
+                    pages[page_number] = data
+            missing = [page_number for page_number in range(first, last + 1) if page_number not in pages]
+            if missing:
+                path = preview_document_path(doc_id)
+                os.utime(path) # Keep it clear of the janitor's upload TTL while it's being previewed
+                load_backend('pdf2image')
+                load_backend('pillow')
+            for run_start, run_end in _consecutive_runs(missing):
+                with track_stage('render'):
+                    for page_number, png_bytes in iter_pdf_page_images(path, run_start, run_end, dpi=dpi):
+                        preview_cache.put((doc_id, page_number, dpi), png_bytes)
+                        pages[page_number] = png_bytes
+    finally:
+        with _preview_lock:
+            render_lock[1] -= 1
+            if not render_lock[1]: # Last one out, nobody else can be waiting on it
+                del _preview_render_locks[doc_id]
+    return pages
+
+def render_preview_strip(doc_id, first, last, dpi):
+    # One PNG with pages first..last side by side, top-aligned on white.
+    key = (doc_id, 'strip', first, last, dpi)
+    data = preview_cache.get(key)
+    if data is not None:
+        return data
+    from PIL import Image
+    pages = render_preview_pages(doc_id, first, last, dpi)
+    images = [Image.open(io.BytesIO(pages[page_number])) for page_number in range(first, last + 1)]
+    width = sum(img.width for img in images) + PREVIEW_STRIP_GAP * (len(images) - 1)
+    strip = Image.new('RGB', (width, max(img.height for img in images)), 'white')
+    x = 0
+    for img in images:
+        strip.paste(img, (x, 0))
+        x += img.width + PREVIEW_STRIP_GAP
+        img.close()
+    buffer = io.BytesIO()
+    strip.save(buffer, 'PNG')
+    data = buffer.getvalue()
+    preview_cache.put(key, data)
+    return data
+
+def parse_preview_dpi(args):
+    dpi = _optional_positive_int(args, 'dpi') or PREVIEW_DEFAULT_DPI
+    if dpi > PREVIEW_MAX_DPI:
+        raise ValueError(f"'dpi' must be at most {PREVIEW_MAX_DPI} for previews.")
+    return dpi
+
+def preview_document_to_json(doc_id, page_count):
+    return {'id': doc_id, 'page_count': page_count,
+            'url': url_for('preview_document_route', doc_id=doc_id),
+            'page_url_template': url_for('preview_page_route', doc_id=doc_id, page_number=0).replace('/0.png', '/{page}.png'),
+            'strip_url': url_for('preview_strip_route', doc_id=doc_id)}
+
+def immutable_png_response(data, etag):
+    response = Response(data, mimetype='image/png')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response.make_conditional(request)
+
+
 # --- Flask Routes ---
 @app.route('/')
 def index():
@@ -234,142 +2476,383 @@ def index():
 
 @app.route('/convert', methods=['POST']) # Route name for url_for: convert_file_route
 def convert_file_route():
-    # ... (Input validation and file saving logic from previous enhanced app.py)
-    # This part remains mostly the same, ensuring it returns JSON
-    if 'file_to_convert' not in request.files:
-        return jsonify(success=False, error="No file part in the request."), 400
-    
-    file = request.files['file_to_convert']
-    target_format = request.form.get('target_format')
+    # Send async=1 to get a job id back immediately instead of waiting for the result.
+    # The input is either a file_to_convert part or the upload_id of a finalized chunked upload.
+    upload_id = request.form.get('upload_id')
+    file = None
+    if upload_id:
+        upload = load_chunked_upload(upload_id)
+        if upload is None or not upload['finalized']:
+            return jsonify(success=False, error="Unknown or unfinished upload."), 400
+        original_filename = upload['filename']
+    else:
+        if 'file_to_convert' not in request.files:
+            return jsonify(success=False, error="No file part in the request."), 400
 
-    if file.filename == '':
-        return jsonify(success=False, error="No file selected."), 400
+        file = request.files['file_to_convert']
+        if file.filename == '':
+            return jsonify(success=False, error="No file selected."), 400
+        original_filename = secure_filename(file.filename)
+
+    target_format = request.form.get('target_format')
     if not target_format:
         return jsonify(success=False, error="No target format specified."), 400
 
-    original_filename = secure_filename(file.filename)
     input_ext = get_file_ext(original_filename)
 
     if input_ext not in ALLOWED_UPLOAD_EXTENSIONS:
         return jsonify(success=False, error=f"Unsupported input file type: .{input_ext}"), 400
+    converter = get_converter(input_ext, target_format)
+    if converter is None:
+        return jsonify(success=False, error=f"Conversion from .{input_ext} to .{target_format} is not supported."), 400
 
     unique_id = uuid.uuid4().hex
     input_filename_on_server = f"{unique_id}_input.{input_ext}"
     input_filepath = os.path.join(app.config['UPLOAD_FOLDER'], input_filename_on_server)
-    
     output_filename_stem = f"{unique_id}_output"
-    output_ext = target_format 
-    if input_ext == 'pdf' and target_format == 'images': output_ext = 'zip' # Default for multiple images
-    
-    output_filename_on_server = f"{output_filename_stem}.{output_ext}"
-    # Default output path, might be overridden by pdf_to_images_robust
-    output_filepath_final_on_server = os.path.join(app.config['CONVERTED_FOLDER'], output_filename_on_server)
-    
-    file.save(input_filepath)
+
+    options = {}
+    if converter['parse_options']:
+        try:
+            options = converter['parse_options'](request.form)
+        except ValueError as e:
+            return jsonify(success=False, error=str(e)), 400
     
-    success = False
-    message = "Conversion process initiated."
-    processed_filename_for_download = None
-
-    try:
-        if input_ext == 'pdf':
-            if target_format == 'docx':
-                success, message = convert_pdf_to_docx_robust(input_filepath, output_filepath_final_on_server)
-            elif target_format == 'images':
-                # output_folder_stem_for_naming is used by pdf_to_images_robust to name individual images and the final zip.
-                # It should be a path stem *inside* the CONVERTED_FOLDER.
-                pdf_to_images_output_stem_for_naming = os.path.join(app.config['CONVERTED_FOLDER'], output_filename_stem)
-                success, message, returned_path = convert_pdf_to_images_robust(input_filepath, pdf_to_images_output_stem_for_naming)
-                if success and returned_path:
-                    output_filepath_final_on_server = returned_path 
-        elif input_ext == 'docx':
-            if target_format == 'pdf':
-                success, message = convert_docx_to_pdf_robust(input_filepath, output_filepath_final_on_server)
-        elif input_ext == 'pptx':
-            if target_format == 'pdf':
-                success, message = convert_pptx_to_pdf_basic(input_filepath, output_filepath_final_on_server)
-        elif input_ext in IMAGE_EXTENSIONS: # jpg, png
-            if target_format == 'pdf':
-                success, message = convert_images_to_pdf_robust([input_filepath], output_filepath_final_on_server)
-            elif target_format in IMAGE_EXTENSIONS: # Image to Image (e.g. PNG to JPG)
-                try:
-                    img = Image.open(input_filepath)
-                    # Handle transparency for JPG output
-                    if target_format.lower() == 'jpg' and img.mode in ('RGBA', 'LA', 'P'):
-                        img = img.convert('RGB')
-                    img.save(output_filepath_final_on_server, format=target_format.upper())
-                    img.close()
-                    success = True
-                    message = f"Image converted to .{target_format.upper()} successfully."
-                except Exception as img_e:
-                    success = False
-                    message = f"Image to {target_format.upper()} conversion failed: {str(img_e)}"
-                    app.logger.error(f"Image to Image conversion error: {img_e}", exc_info=True)
-            else:
-                success = False
-                message = f"Unsupported target format '{target_format}' for image input."
+    with track_stage('receive'):
+        if file is None:
+            input_digest = claim_chunked_upload(upload_id, input_filepath)
         else:
-            success = False
-            message = f"Conversion from .{input_ext} to .{target_format} is not supported."
+            input_digest = save_upload_hashed(file, input_filepath)
+    if input_digest is None:
+        return jsonify(success=False, error="Unknown or unfinished upload."), 400
+    with track_stage('cache_lookup'):
+        cache_key = conversion_cache_key(input_digest, input_ext, target_format, options)
+        cached_filename = conversion_cache.get(cache_key)
+    if cached_filename:
+        with track_stage('cleanup'):
+            cleanup_files(input_filepath)
+        download_url = url_for('download_file_route', filename=cached_filename)
+        return jsonify(success=True, message="Conversion result served from cache.", filename=cached_filename,
+                       download_url=download_url, cached=True)
+
+    ticket = admit_request(estimate_conversion_cost, input_ext, target_format, input_filepath, options)
+    if ticket is None:
+        cleanup_files(input_filepath)
+        return job_queue_full_response()
+
+    if wants_async():
+        with track_stage('enqueue'):
+            job_id = submit_job('convert', perform_conversion, input_ext, target_format, input_filepath, output_filename_stem, options,
+                                cleanup_paths=[input_filepath], on_success=lambda path: conversion_cache.put(cache_key, path),
+                                on_done=lambda: admission.release(ticket))
+        if job_id is None:
+            admission.release(ticket)
+            cleanup_files(input_filepath)
+            return job_queue_full_response()
+        return job_accepted_response(job_id, "Conversion queued.")
+
+    try:
+        with track_stage('convert'):
+            success, message, output_filepath_final_on_server = perform_conversion(input_ext, target_format, input_filepath, output_filename_stem, options)
 
         if success:
+            conversion_cache.put(cache_key, output_filepath_final_on_server)
             processed_filename_for_download = os.path.basename(output_filepath_final_on_server)
             download_url = url_for('download_file_route', filename=processed_filename_for_download) # Corrected endpoint name
             return jsonify(success=True, message=message, filename=processed_filename_for_download, download_url=download_url)
         else:
-            cleanup_files(output_filepath_final_on_server)
             return jsonify(success=False, error=message), 422
 
     except Exception as e:
         app.logger.error(f"General conversion route error: {e}", exc_info=True)
-        cleanup_files(output_filepath_final_on_server)
         return jsonify(success=False, error=f"An unexpected server error occurred: {str(e)}"), 500
     finally:
+        admission.release(ticket)
+        with track_stage('cleanup'):
+            cleanup_files(input_filepath)
+
+
+@app.route('/convert/pdf-to-images/stream', methods=['POST']) # Route name for url_for: stream_pdf_images_route
+def stream_pdf_images_route():
+    # Renders pages window by window and streams them back as a ZIP while rendering, nothing but
+    # the uploaded PDF touches the disk. Accepts the same dpi/first_page/last_page/grayscale options as /convert.
+    if 'file_to_convert' not in request.files:
+        return jsonify(success=False, error="No file part in the request."), 400
+
+    file = request.files['file_to_convert']
+    if file.filename == '':
+        return jsonify(success=False, error="No file selected."), 400
+
+    original_filename = secure_filename(file.filename)
+    if get_file_ext(original_filename) != 'pdf':
+        return jsonify(success=False, error="Only PDF files can be streamed as images."), 400
+
+    try:
+        options = parse_pdf_render_options(request.form)
+    except ValueError as e:
+        return jsonify(success=False, error=str(e)), 400
+
+    unique_id = uuid.uuid4().hex
+    input_filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{unique_id}_input.pdf")
+    file.save(input_filepath)
+
+    try:
+        first, last = resolve_pdf_page_range(input_filepath, options['first_page'], options['last_page'])
+    except ValueError as e: # Page selection outside the document
+        cleanup_files(input_filepath)
+        return jsonify(success=False, error=str(e)), 422
+    except Exception as e:
         cleanup_files(input_filepath)
+        app.logger.error(f"PDF to Images stream setup error: {e}", exc_info=True)
+        return jsonify(success=False, error=f"Failed to read PDF. Ensure Poppler is installed and in PATH. Error: {str(e)}"), 422
+
+    ticket = admit_request(estimate_conversion_cost, 'pdf', 'images', input_filepath, options)
+    if ticket is None:
+        cleanup_files(input_filepath)
+        return job_queue_full_response()
+
+    stem_name = os.path.splitext(original_filename)[0] or unique_id
+
+    def generate():
+        try:
+            pages = iter_pdf_page_images(input_filepath, first, last, dpi=options['dpi'], grayscale=options['grayscale'])
+            entries = ((f"{stem_name}_page_{page_number}.png", png_bytes, zipfile.ZIP_STORED) for page_number, png_bytes in pages)
+            yield from iter_zip_stream(entries)
+        except Exception as e:
+            # Headers are already sent, all we can do is cut the stream short
+            app.logger.error(f"PDF to Images stream error: {e}", exc_info=True)
+        finally:
+            cleanup_files(input_filepath)
+
+    response = Response(stream_with_context(generate()), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename="{stem_name}_pages.zip"'
+    response.call_on_close(lambda: admission.release(ticket)) # Also when the stream never starts
+    return response
+
+
+@app.route('/convert/batch', methods=['POST']) # Route name for url_for: batch_convert_route
+def batch_convert_route():
+    # Many files in one request: 'files' parts and/or 'upload_ids' of finalized chunked uploads, with
+    # either one 'target_format' for all of them or 'target_formats' given per file (files first, then uploads).
+    # Converter options in the form (dpi, pages, quality, ...) work as on /convert, for every file they apply to.
+    # Conversions fan out over the job pool and the ZIP streams back in completion order, ending with
+    # a manifest.json that records each file's outcome, so one bad file doesn't sink the batch.
+    files = [f for f in request.files.getlist('files') if f and f.filename]
+    upload_ids = request.form.getlist('upload_ids')
+    sources = [(secure_filename(f.filename), f) for f in files]
+    for upload_id in upload_ids:
+        upload = load_chunked_upload(upload_id)
+        if upload is None or not upload['finalized']:
+            return jsonify(success=False, error="Unknown or unfinished upload."), 400
+        sources.append((upload['filename'], upload_id))
+
+    if not sources:
+        return jsonify(success=False, error="No files selected for conversion."), 400
+    if len(sources) > app.config['BATCH_MAX_FILES']:
+        return jsonify(success=False, error=f"A batch may contain at most {app.config['BATCH_MAX_FILES']} files."), 400
+
+    target_formats = request.form.getlist('target_formats')
+    if not target_formats and request.form.get('target_format'):
+        target_formats = [request.form['target_format']] * len(sources)
+    if len(target_formats) != len(sources):
+        return jsonify(success=False, error="Provide one target format for the batch, or one per file."), 400
+
+    batch_id = uuid.uuid4().hex
+    items = []
+    for index, ((original_filename, source), target_format) in enumerate(zip(sources, target_formats)):
+        input_ext = get_file_ext(original_filename)
+        item = {'index': index + 1, 'filename': original_filename, 'target_format': target_format,
+                'success': False, 'cached': False, 'message': None, 'output': None, 'input_path': None}
+        items.append(item)
+        if input_ext not in ALLOWED_UPLOAD_EXTENSIONS:
+            item['message'] = f"Unsupported input file type: .{input_ext}"
+            continue
+        converter = get_converter(input_ext, target_format)
+        if converter is None:
+            item['message'] = f"Conversion from .{input_ext} to .{target_format} is not supported."
+            continue
+        try: # The batch form's options (dpi, pages, quality, ...) apply to every file whose converter takes them
+            item['options'] = converter['parse_options'](request.form) if converter['parse_options'] else {}
+        except ValueError as e:
+            item['message'] = str(e)
+            continue
+        item['input_path'] = os.path.join(app.config['UPLOAD_FOLDER'], f"{batch_id}_{index + 1}_input.{input_ext}")
+        if isinstance(source, str):
+            input_digest = claim_chunked_upload(source, item['input_path'])
+            if input_digest is None:
+                item['message'], item['input_path'] = "Unknown or unfinished upload.", None
+                continue
+        else:
+            input_digest = save_upload_hashed(source, item['input_path'])
+        item['input_ext'] = input_ext
+        item['cache_key'] = conversion_cache_key(input_digest, input_ext, target_format, item['options'])
+
+    to_convert = []
+    for item in items:
+        if not item['input_path']:
+            continue
+        cached_filename = conversion_cache.get(item['cache_key'])
+        if cached_filename:
+            item.update(success=True, cached=True, message="Conversion result served from cache.",
+                        output_path=os.path.join(app.config['CONVERTED_FOLDER'], cached_filename))
+        else:
+            to_convert.append(item)
+
+    def batch_cost():
+        # CPU adds up; memory peaks with the largest items that can run side by side on the job pool
+        costs = [estimate_conversion_cost(item['input_ext'], item['target_format'], item['input_path'], item['options'])
+                 for item in to_convert]
+        memory = sorted((cost[1] for cost in costs), reverse=True)[:app.config['JOB_WORKERS']]
+        return sum(cost[0] for cost in costs), sum(memory)
+
+    ticket = admit_request(batch_cost)
+    if ticket is None:
+        cleanup_files(*(item['input_path'] for item in items))
+        return job_queue_full_response()
+
+    executor = get_job_executor()
+    futures = {}
+    try:
+        for item in to_convert:
+            output_filename_stem = f"{batch_id}_{item['index']}_output"
+            futures[executor.submit(perform_conversion, item['input_ext'], item['target_format'], item['input_path'],
+                                    output_filename_stem, item['options'])] = item
+    except BrokenProcessPool:
+        _reset_job_executor(executor)
+        for future in futures:
+            future.cancel()
+        admission.release(ticket)
+        cleanup_files(*(item['input_path'] for item in items))
+        return job_queue_full_response()
+
+    def batch_arcname(item, output_path):
+        stem = os.path.splitext(item['filename'])[0] or 'file'
+        return f"{item['index']:03d}_{stem}{os.path.splitext(output_path)[1]}"
+
+    def entries():
+        for item in items: # Cache hits go out first
+            if item['cached']:
+                item['output'] = batch_arcname(item, item['output_path'])
+                yield item['output'], item['output_path'], zipfile.ZIP_STORED
+        for future in as_completed(futures):
+            item = futures[future]
+            try:
+                item['success'], item['message'], output_path = future.result()
+            except Exception as e:
+                app.logger.error(f"Batch conversion error for {item['filename']}: {e}", exc_info=True)
+                item['message'], output_path = f"An unexpected server error occurred: {str(e)}", None
+            cleanup_files(item['input_path'])
+            if item['success']:
+                conversion_cache.put(item['cache_key'], output_path)
+                item['output'] = batch_arcname(item, output_path)
+                # Converter outputs (PDF, DOCX, PNG, ZIP) are already compressed
+                yield item['output'], output_path, zipfile.ZIP_STORED
+        manifest = [{k: item[k] for k in ('index', 'filename', 'target_format', 'success', 'cached', 'message', 'output')}
+                    for item in items]
+        yield 'manifest.json', json.dumps({'files': manifest}, indent=2).encode(), zipfile.ZIP_DEFLATED
+
+    def generate():
+        try:
+            yield from iter_zip_stream(entries())
+        except Exception as e:
+            app.logger.error(f"Batch conversion stream error: {e}", exc_info=True)
+        finally:
+            # Also runs if the client goes away mid-stream
+            for future in futures:
+                future.cancel()
+            cleanup_files(*(item['input_path'] for item in items if item['input_path']))
+
+    response = Response(stream_with_context(generate()), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename="batch_{batch_id[:8]}.zip"'
+    response.call_on_close(lambda: admission.release(ticket))
+    return response
 
 
 @app.route('/merge', methods=['POST']) # Route name for url_for: merge_files_route
 def merge_files_route():
-    # ... (Input validation and file saving logic from previous enhanced app.py)
-    # This part remains mostly the same, ensuring it returns JSON
-    if 'files_to_merge' not in request.files:
-        return jsonify(success=False, error="No files part in the request."), 400
+    # Send async=1 to get a job id back immediately instead of waiting for the result.
+    # Inputs are files_to_merge parts, or upload_ids of finalized chunked uploads (in merge order).
+    upload_ids = request.form.getlist('upload_ids')
+    if upload_ids:
+        uploads = [load_chunked_upload(upload_id) for upload_id in upload_ids]
+        if any(upload is None or not upload['finalized'] for upload in uploads):
+            return jsonify(success=False, error="Unknown or unfinished upload."), 400
+        files = upload_ids
+        sources = [(upload['filename'], upload_id) for upload, upload_id in zip(uploads, upload_ids)]
+    else:
+        if 'files_to_merge' not in request.files:
+            return jsonify(success=False, error="No files part in the request."), 400
 
-    files = request.files.getlist('files_to_merge')
-    merge_type = request.form.get('merge_type', '').lower()
+        files = request.files.getlist('files_to_merge')
+        if not files or all(f.filename == '' for f in files):
+            return jsonify(success=False, error="No files selected for merging."), 400
+        sources = [(secure_filename(f.filename) if f else '', f) for f in files]
 
-    if not files or all(f.filename == '' for f in files):
-        return jsonify(success=False, error="No files selected for merging."), 400
+    merge_type = request.form.get('merge_type', '').lower()
     if not merge_type:
          return jsonify(success=False, error="Merge type not specified or detected."), 400
-    if merge_type not in ['pdf', 'docx']:
-        return jsonify(success=False, error=f"Merging for '.{merge_type}' files is not supported at this time."), 400 # Only PDF and DOCX for now
+    if merge_type not in ['pdf', 'docx', 'images']:
+        return jsonify(success=False, error=f"Merging for '.{merge_type}' files is not supported at this time."), 400 # PDF, DOCX, and images into a PDF
     if len(files) < 2:
         return jsonify(success=False, error="Please select at least two files to merge."), 400
 
+    # Optional PDF-only settings: one page range spec per file (e.g. "1-5,9", blank for all pages)
+    # and merge_mode=incremental for the low-memory engine, which page ranges always use.
+    page_ranges = request.form.getlist('page_ranges')
+    merge_mode = request.form.get('merge_mode', 'standard').lower()
+    if merge_mode not in ('standard', 'incremental'):
+        return jsonify(success=False, error=f"Unknown merge mode '{merge_mode}'."), 400
+    if page_ranges:
+        if merge_type != 'pdf':
+            return jsonify(success=False, error="Page ranges are only supported when merging PDFs."), 400
+        if len(page_ranges) != len(files):
+            return jsonify(success=False, error="Provide one page range per file (leave it blank for all pages)."), 400
+        try:
+            for page_range_spec in page_ranges:
+                parse_page_ranges(page_range_spec)
+        except ValueError as e:
+            return jsonify(success=False, error=str(e)), 400
+    image_options = None
+    if merge_type == 'images':
+        try:
+            image_options = parse_image_options(request.form)
+        except ValueError as e:
+            return jsonify(success=False, error=str(e)), 400
+
     input_filepaths_on_server = []
     original_filenames_stem = [] # For naming the merged file
     all_files_valid_for_merge = True
     error_message_for_client = "An unknown error occurred validating files for merge."
 
 
-    for file in files:
-        if file and file.filename != '':
-            original_filename = secure_filename(file.filename)
+    receive_started = time.perf_counter()
+    for original_filename, source in sources:
+        if source and original_filename != '':
             file_ext = get_file_ext(original_filename)
-            if file_ext != merge_type:
+            if merge_type == 'images' and file_ext not in IMAGE_EXTENSIONS:
+                all_files_valid_for_merge = False
+                error_message_for_client = f"All files must be images (.jpg, .png, .webp). File '{original_filename}' is a '.{file_ext}'."
+                break
+            if merge_type != 'images' and file_ext != merge_type:
                 all_files_valid_for_merge = False
                 error_message_for_client = f"All files must be of type '.{merge_type}'. File '{original_filename}' is a '.{file_ext}'."
                 break # Stop processing further files
             
             temp_input_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4().hex}_{original_filename}")
-            file.save(temp_input_path)
+            if upload_ids:
+                if claim_chunked_upload(source, temp_input_path) is None:
+                    all_files_valid_for_merge = False
+                    error_message_for_client = "Unknown or unfinished upload."
+                    break
+            else:
+                source.save(temp_input_path)
             input_filepaths_on_server.append(temp_input_path)
             original_filenames_stem.append(os.path.splitext(original_filename)[0])
         else:
             all_files_valid_for_merge = False
             error_message_for_client = "An empty or invalid file was encountered during merge."
             break 
+    metrics.observe('filepro_stage_duration_seconds', time.perf_counter() - receive_started, route=request.endpoint, stage='receive')
             
     if not all_files_valid_for_merge:
         cleanup_files(*input_filepaths_on_server) # Clean up any files already saved
@@ -378,32 +2861,411 @@ def merge_files_route():
     # Proceed with merging
     # Use a more descriptive name for the merged file
     merged_file_base_name = f"merged_{merge_type}_{original_filenames_stem[0]}_{uuid.uuid4().hex[:4]}"
-    output_filename_on_server = f"{merged_file_base_name}.{merge_type}"
+    output_filename_on_server = f"{merged_file_base_name}.{'pdf' if merge_type == 'images' else merge_type}"
     output_filepath_on_server = os.path.join(app.config['CONVERTED_FOLDER'], output_filename_on_server)
-    
-    success = False
-    message = "Merge process initiated." # Default message
+
+    ticket = admit_request(estimate_merge_cost, merge_type, input_filepaths_on_server,
+                           'incremental' if page_ranges else merge_mode, image_options)
+    if ticket is None:
+        cleanup_files(*input_filepaths_on_server)
+        return job_queue_full_response()
+
+    if wants_async():
+        with track_stage('enqueue'):
+            job_id = submit_job('merge', perform_merge, merge_type, input_filepaths_on_server, output_filepath_on_server,
+                                page_ranges, merge_mode, image_options, cleanup_paths=input_filepaths_on_server,
+                                on_done=lambda: admission.release(ticket))
+        if job_id is None:
+            admission.release(ticket)
+            cleanup_files(*input_filepaths_on_server)
+            return job_queue_full_response()
+        return job_accepted_response(job_id, "Merge queued.")
 
     try:
-        if merge_type == 'pdf':
-            success, message = merge_pdf_files_robust(input_filepaths_on_server, output_filepath_on_server)
-        elif merge_type == 'docx':
-            success, message = merge_docx_files_robust(input_filepaths_on_server, output_filepath_on_server)
-        # Add other merge types if implemented
+        with track_stage('merge'):
+            success, message, _, stats = perform_merge(merge_type, input_filepaths_on_server, output_filepath_on_server,
+                                                       page_ranges, merge_mode, image_options)
 
         if success:
             download_url = url_for('download_file_route', filename=output_filename_on_server) # Corrected endpoint name
-            return jsonify(success=True, message=message, filename=output_filename_on_server, download_url=download_url)
+            return jsonify(success=True, message=message, filename=output_filename_on_server, download_url=download_url, stats=stats)
         else:
-            cleanup_files(output_filepath_on_server) # Clean failed merge output
-            return jsonify(success=False, error=message), 500 # Internal server error if merge function failed
+            return jsonify(success=False, error=message, stats=stats), 500 # Internal server error if merge function failed
 
     except Exception as e:
         app.logger.error(f"General merge route error: {e}", exc_info=True)
-        cleanup_files(output_filepath_on_server) # Clean up if error
         return jsonify(success=False, error=f"An unexpected server error occurred during merge: {str(e)}"), 500
     finally:
-        cleanup_files(*input_filepaths_on_server) # Always cleanup uploaded inputs
+        admission.release(ticket)
+        with track_stage('cleanup'):
+            cleanup_files(*input_filepaths_on_server) # Always cleanup uploaded inputs
+
+
+@app.route('/pipeline', methods=['POST']) # Route name for url_for: pipeline_route
+def pipeline_route():
+    # Inputs are 'files' parts and/or 'upload_ids' of finalized chunked uploads, in that order; 'steps' is a
+    # JSON list (see the Pipelines section). Send async=1 to get a job id back instead of waiting.
+    files = [f for f in request.files.getlist('files') if f and f.filename]
+    upload_ids = request.form.getlist('upload_ids')
+    sources = [(secure_filename(f.filename), f) for f in files]
+    for upload_id in upload_ids:
+        upload = load_chunked_upload(upload_id)
+        if upload is None or not upload['finalized']:
+            return jsonify(success=False, error="Unknown or unfinished upload."), 400
+        sources.append((upload['filename'], upload_id))
+    if not sources:
+        return jsonify(success=False, error="No files selected for the pipeline."), 400
+    if len(sources) > app.config['BATCH_MAX_FILES']:
+        return jsonify(success=False, error=f"A pipeline may take at most {app.config['BATCH_MAX_FILES']} files."), 400
+
+    input_exts = [get_file_ext(original_filename) for original_filename, _ in sources]
+    unsupported = [ext for ext in input_exts if ext not in ALLOWED_UPLOAD_EXTENSIONS]
+    if unsupported:
+        return jsonify(success=False, error=f"Unsupported input file type: .{unsupported[0]}"), 400
+    try:
+        steps = plan_pipeline(input_exts, json.loads(request.form.get('steps') or 'null'))
+    except json.JSONDecodeError:
+        return jsonify(success=False, error="'steps' must be valid JSON."), 400
+    except ValueError as e:
+        return jsonify(success=False, error=str(e)), 400
+
+    pipeline_id = uuid.uuid4().hex
+    scratch_dir = os.path.join(app.config['UPLOAD_FOLDER'], f"pipeline_{pipeline_id}")
+    os.makedirs(scratch_dir)
+    items = []
+    with track_stage('receive'):
+        for index, ((original_filename, source), input_ext) in enumerate(zip(sources, input_exts), start=1):
+            input_path = os.path.join(scratch_dir, f"input_{index}.{input_ext}")
+            if isinstance(source, str):
+                if claim_chunked_upload(source, input_path) is None:
+                    cleanup_files(scratch_dir)
+                    return jsonify(success=False, error="Unknown or unfinished upload."), 400
+            else:
+                source.save(input_path)
+            items.append({'path': input_path, 'ext': input_ext, 'name': os.path.splitext(original_filename)[0] or f"file{index}"})
+    output_stem = f"{pipeline_id}_pipeline"
+
+    ticket = admit_request(estimate_pipeline_cost, items, steps)
+    if ticket is None:
+        cleanup_files(scratch_dir)
+        return job_queue_full_response()
+
+    if wants_async():
+        with track_stage('enqueue'):
+            job_id = submit_job('pipeline', run_pipeline, scratch_dir, items, steps, output_stem, cleanup_paths=[scratch_dir],
+                                on_done=lambda: admission.release(ticket))
+        if job_id is None:
+            admission.release(ticket)
+            cleanup_files(scratch_dir)
+            return job_queue_full_response()
+        return job_accepted_response(job_id, "Pipeline queued.")
+
+    try:
+        with track_stage('pipeline'):
+            success, message, output_path, details = run_pipeline(scratch_dir, items, steps, output_stem)
+        if not success:
+            return jsonify(success=False, error=message, details=details), 422
+        filename = os.path.basename(output_path)
+        return jsonify(success=True, message=message, filename=filename,
+                       download_url=url_for('download_file_route', filename=filename), details=details)
+    except Exception as e:
+        app.logger.error(f"Pipeline route error: {e}", exc_info=True)
+        return jsonify(success=False, error=f"An unexpected server error occurred: {str(e)}"), 500
+    finally:
+        admission.release(ticket)
+        with track_stage('cleanup'):
+            cleanup_files(scratch_dir)
+
+
+@app.route('/uploads', methods=['POST']) # Route name for url_for: init_chunked_upload_route
+def init_chunked_upload_route():
+    data = request.get_json(silent=True) or request.form
+    original_filename = secure_filename(data.get('filename') or '')
+    if not original_filename:
+        return jsonify(success=False, error="No filename specified."), 400
+    if get_file_ext(original_filename) not in ALLOWED_UPLOAD_EXTENSIONS:
+        return jsonify(success=False, error=f"Unsupported input file type: .{get_file_ext(original_filename)}"), 400
+
+    total_size = data.get('total_size')
+    try:
+        total_size = int(total_size) if total_size not in (None, '') else None
+    except (TypeError, ValueError):
+        return jsonify(success=False, error="'total_size' must be a whole number of bytes."), 400
+    if total_size is not None and not 0 < total_size <= app.config['CHUNKED_UPLOAD_MAX_BYTES']:
+        return jsonify(success=False, error=f"Uploads must be between 1 byte and {app.config['CHUNKED_UPLOAD_MAX_BYTES']} bytes."), 413
+
+    upload_id = uuid.uuid4().hex
+    data_path, _ = _chunked_upload_paths(upload_id)
+    open(data_path, 'wb').close()
+    meta = {'filename': original_filename, 'total_size': total_size, 'finalized': False, 'created_at': time.time()}
+    _save_chunked_upload_meta(upload_id, meta)
+    _prune_upload_hashers()
+    _upload_hashers[upload_id] = (0, hashlib.sha256())
+    meta['received'] = 0
+    return jsonify(success=True, upload=chunked_upload_to_json(upload_id, meta)), 201
+
+@app.route('/uploads/<upload_id>', methods=['GET']) # Route name for url_for: chunked_upload_status_route
+def chunked_upload_status_route(upload_id):
+    meta = load_chunked_upload(upload_id)
+    if meta is None:
+        return jsonify(success=False, error="Unknown upload. It may have expired."), 404
+    return jsonify(success=True, upload=chunked_upload_to_json(upload_id, meta))
+
+@app.route('/uploads/<upload_id>', methods=['PUT']) # Route name for url_for: append_chunk_route
+def append_chunk_route(upload_id):
+    # Raw chunk bytes in the body; the offset they start at in ?offset= or an Upload-Offset header.
+    offset = request.args.get('offset', request.headers.get('Upload-Offset', ''))
+    if not offset.isdigit():
+        return jsonify(success=False, error="Chunk offset is missing or invalid."), 400
+    offset = int(offset)
+
+    data_path, meta_path = _chunked_upload_paths(upload_id)
+    if not _chunked_upload_exists(upload_id):
+        return jsonify(success=False, error="Unknown upload. It may have expired."), 404
+    with _upload_lock(upload_id):
+        meta = load_chunked_upload(upload_id)
+        if meta is None:
+            return jsonify(success=False, error="Unknown upload. It may have expired."), 404
+        if meta['finalized']:
+            return jsonify(success=False, error="Upload is already finalized."), 409
+        if offset != meta['received']:
+            # Client is out of sync (e.g. after a dropped connection); tell it where to resume
+            return jsonify(success=False, error="Offset does not match the bytes received so far.",
+                           upload=chunked_upload_to_json(upload_id, meta)), 409
+
+        limit = meta['total_size'] or app.config['CHUNKED_UPLOAD_MAX_BYTES']
+        digest = _upload_hasher_at(upload_id, offset)
+        received = offset
+        try:
+            with open(data_path, 'r+b') as out:
+                out.seek(offset)
+                while True:
+                    chunk = request.stream.read(IO_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    if received + len(chunk) > limit:
+                        out.truncate(received)
+                        return jsonify(success=False, error="Chunk runs past the declared upload size."), 413
+                    out.write(chunk)
+                    if digest is not None:
+                        digest.update(chunk)
+                    received += len(chunk)
+        finally:
+            # Whatever made it to disk is kept and accounted for, so a broken chunk can be resumed
+            if digest is not None:
+                _upload_hashers[upload_id] = (received, digest)
+            try:
+                os.utime(meta_path) # The janitor's upload TTL runs from the last chunk, not from init
+            except OSError:
+                pass # Aborted meanwhile; the next request will report it
+
+    meta['received'] = received
+    return jsonify(success=True, upload=chunked_upload_to_json(upload_id, meta))
+
+@app.route('/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_chunked_upload_route(upload_id):
+    data = request.get_json(silent=True) or request.form
+    expected_sha256 = (data.get('sha256') or '').lower()
+    data_path, _ = _chunked_upload_paths(upload_id)
+    if not _chunked_upload_exists(upload_id):
+        return jsonify(success=False, error="Unknown upload. It may have expired."), 404
+    with _upload_lock(upload_id):
+        meta = load_chunked_upload(upload_id)
+        if meta is None:
+            return jsonify(success=False, error="Unknown upload. It may have expired."), 404
+        if not meta['finalized']:
+            if meta['total_size'] is not None and meta['received'] != meta['total_size']:
+                return jsonify(success=False, error=f"Upload is incomplete: {meta['received']} of {meta['total_size']} bytes received.",
+                               upload=chunked_upload_to_json(upload_id, meta)), 409
+            if meta['received'] == 0:
+                return jsonify(success=False, error="Upload is empty."), 400
+            digest = _upload_hasher_at(upload_id, meta['received']) or _hash_file(data_path)
+            meta['sha256'] = digest.hexdigest()
+            if expected_sha256 and expected_sha256 != meta['sha256']:
+                return jsonify(success=False, error="Checksum mismatch. Please upload the file again."), 422
+            meta['finalized'] = True
+            _save_chunked_upload_meta(upload_id, meta)
+    return jsonify(success=True, upload=chunked_upload_to_json(upload_id, meta))
+
+@app.route('/uploads/<upload_id>', methods=['DELETE'])
+def abort_chunked_upload_route(upload_id):
+    data_path, meta_path = _chunked_upload_paths(upload_id)
+    if not _chunked_upload_exists(upload_id):
+        return jsonify(success=False, error="Unknown upload. It may have expired."), 404
+    with _upload_lock(upload_id):
+        cleanup_files(data_path, meta_path)
+        _upload_hashers.pop(upload_id, None)
+    return jsonify(success=True, message="Upload discarded.")
+
+
+@app.route('/jobs/<job_id>', methods=['GET']) # Route name for url_for: job_status_route
+def job_status_route(job_id):
+    job = load_job(job_id)
+    if job is None:
+        return jsonify(success=False, error="Unknown job. It may have expired."), 404
+    data = job_to_json(job)
+    return jsonify(success=data['status'] != 'failed', job=data)
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job_route(job_id):
+    # Only jobs still waiting for a worker can be cancelled; running ones finish normally.
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        future = job['future'] if job else None
+    if future is not None:
+        if not future.cancel():
+            return jsonify(success=False, error="Job is already running or finished."), 409
+        return jsonify(success=True, message="Job cancelled.")
+    job = load_job(job_id) # Owned by another web process: leave a marker its worker checks before starting
+    if job is None:
+        return jsonify(success=False, error="Unknown job. It may have expired."), 404
+    if job['status'] != 'queued':
+        return jsonify(success=False, error="Job is already running or finished."), 409
+    with open(_job_record_paths(job_id)[1], 'w'):
+        pass
+    return jsonify(success=True, message="Job cancellation requested; it won't start."), 202
+
+
+@app.route('/metrics', methods=['GET']) # Route name for url_for: metrics_route
+def metrics_route():
+    # Prometheus text exposition. Job, cache, storage, preview and admission gauges are sampled at scrape time.
+    with _jobs_lock:
+        job_counts = {status: 0 for status in ('queued', 'running', 'finished', 'failed', 'cancelled')}
+        for job in _jobs.values():
+            job_counts[job['status']] = job_counts.get(job['status'], 0) + 1
+    for status, count in job_counts.items():
+        metrics.set('filepro_jobs', count, status=status)
+    for stat_name, value in conversion_cache.stats().items():
+        if isinstance(value, (int, float)):
+            metrics.set('filepro_result_cache', value, stat=stat_name)
+    storage = storage_janitor.stats()
+    for stat_name, value in storage.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics.set('filepro_storage', value, stat=stat_name)
+    for folder_name, usage in storage['usage'].items():
+        metrics.set('filepro_storage', usage['bytes'], stat='bytes', folder=folder_name)
+        metrics.set('filepro_storage', usage['files'], stat='files', folder=folder_name)
+    for stat_name, value in preview_cache.stats().items():
+        metrics.set('filepro_preview_cache', value, stat=stat_name)
+    for stat_name, value in admission.stats().items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics.set('filepro_admission', value, stat=stat_name)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats_route():
+    return jsonify(success=True, cache=conversion_cache.stats())
+
+
+@app.route('/storage/stats', methods=['GET'])
+def storage_stats_route():
+    return jsonify(success=True, storage=storage_janitor.stats())
+
+
+@app.route('/admission/stats', methods=['GET'])
+def admission_stats_route():
+    return jsonify(success=True, admission=admission.stats())
+
+
+@app.route('/preview', methods=['POST']) # Route name for url_for: create_preview_route
+def create_preview_route():
+    # Takes a PDF as file_to_preview or the upload_id of a finalized chunked upload. Clients that already
+    # know the file's sha256 can GET /preview/<sha256> first and skip the upload when it's stored.
+    upload_id = request.form.get('upload_id')
+    if upload_id:
+        upload = load_chunked_upload(upload_id)
+        if upload is None or not upload['finalized']:
+            return jsonify(success=False, error="Unknown or unfinished upload."), 400
+        original_filename = upload['filename']
+    else:
+        file = request.files.get('file_to_preview')
+        if file is None or file.filename == '':
+            return jsonify(success=False, error="No file selected."), 400
+        original_filename = secure_filename(file.filename)
+    if get_file_ext(original_filename) != 'pdf':
+        return jsonify(success=False, error="Only PDF files can be previewed."), 400
+
+    temp_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4().hex}_preview.pdf")
+    with track_stage('receive'):
+        doc_id = claim_chunked_upload(upload_id, temp_path) if upload_id else save_upload_hashed(file, temp_path)
+    if doc_id is None:
+        return jsonify(success=False, error="Unknown or unfinished upload."), 400
+    try:
+        page_count = store_preview_document(temp_path, doc_id)
+    except Exception as e:
+        app.logger.warning(f"Preview upload is not a readable PDF: {e}")
+        return jsonify(success=False, error="The file could not be read as a PDF."), 422
+    return jsonify(success=True, document=preview_document_to_json(doc_id, page_count))
+
+
+@app.route('/preview/<doc_id>', methods=['GET']) # Route name for url_for: preview_document_route
+def preview_document_route(doc_id):
+    page_count = preview_page_count(doc_id)
+    if page_count is None:
+        return jsonify(success=False, error="Unknown preview document, upload it first."), 404
+    return jsonify(success=True, document=preview_document_to_json(doc_id, page_count))
+
+
+@app.route('/preview/<doc_id>/pages/<int:page_number>.png', methods=['GET']) # Route name for url_for: preview_page_route
+def preview_page_route(doc_id, page_number):
+    # ?dpi= (default PREVIEW_DEFAULT_DPI, at most PREVIEW_MAX_DPI)
+    try:
+        dpi = parse_preview_dpi(request.args)
+    except ValueError as e:
+        return jsonify(success=False, error=str(e)), 400
+    etag = f"{doc_id}-{page_number}-{dpi}"
+    if request.if_none_match.contains(etag): # Revalidation needs neither the cache nor the document
+        return immutable_png_response(b'', etag)
+    page_count = preview_page_count(doc_id)
+    if page_count is None:
+        return jsonify(success=False, error="Unknown preview document, upload it first."), 404
+    if not 1 <= page_number <= page_count:
+        return jsonify(success=False, error=f"Page {page_number} is outside the document ({page_count} page(s))."), 404
+    try:
+        data = render_preview_pages(doc_id, page_number, page_number, dpi)[page_number]
+    except FileNotFoundError:
+        preview_page_count(doc_id) # Drops the stale page count
+        return jsonify(success=False, error="Unknown preview document, upload it first."), 404
+    except Exception as e:
+        app.logger.error(f"Preview render error: {e}", exc_info=True)
+        return jsonify(success=False, error=f"Failed to render the page. Ensure Poppler is installed and in PATH. Error: {str(e)}"), 422
+    return immutable_png_response(data, etag)
+
+
+@app.route('/preview/<doc_id>/strip.png', methods=['GET']) # Route name for url_for: preview_strip_route
+def preview_strip_route(doc_id):
+    # Thumbnail strip: ?first= (default 1), ?count= (default and maximum PREVIEW_STRIP_MAX_PAGES), ?dpi=
+    try:
+        dpi = parse_preview_dpi(request.args)
+        first = _optional_positive_int(request.args, 'first') or 1
+        count = min(_optional_positive_int(request.args, 'count') or app.config['PREVIEW_STRIP_MAX_PAGES'],
+                    app.config['PREVIEW_STRIP_MAX_PAGES'])
+    except ValueError as e:
+        return jsonify(success=False, error=str(e)), 400
+    page_count = preview_page_count(doc_id)
+    if page_count is None:
+        return jsonify(success=False, error="Unknown preview document, upload it first."), 404
+    if first > page_count:
+        return jsonify(success=False, error=f"Page {first} is outside the document ({page_count} page(s))."), 404
+    last = min(first + count - 1, page_count)
+    etag = f"{doc_id}-strip-{first}-{last}-{dpi}"
+    if request.if_none_match.contains(etag):
+        return immutable_png_response(b'', etag)
+    try:
+        data = render_preview_strip(doc_id, first, last, dpi)
+    except FileNotFoundError:
+        preview_page_count(doc_id) # Drops the stale page count
+        return jsonify(success=False, error="Unknown preview document, upload it first."), 404
+    except Exception as e:
+        app.logger.error(f"Preview strip render error: {e}", exc_info=True)
+        return jsonify(success=False, error=f"Failed to render the pages. Ensure Poppler is installed and in PATH. Error: {str(e)}"), 422
+    return immutable_png_response(data, etag)
+
+
+@app.route('/preview/stats', methods=['GET'])
+def preview_stats_route():
+    return jsonify(success=True, cache=preview_cache.stats())
 
 
 @app.route('/download/<path:filename>') # Route name for url_for: download_file_route
@@ -412,14 +3274,24 @@ def download_file_route(filename): # Changed function name to match
     if ".." in safe_filename or safe_filename.startswith("/"):
         app.logger.warning(f"Attempted directory traversal: {filename}")
         return "Invalid filename provided.", 400
-    
+
+    file_path = os.path.join(app.config['CONVERTED_FOLDER'], safe_filename)
     try:
-        return send_from_directory(app.config['CONVERTED_FOLDER'], safe_filename, as_attachment=True)
+        stat_result = os.stat(file_path)
     except FileNotFoundError:
+        stat_result = None
+    if stat_result is None or not stat.S_ISREG(stat_result.st_mode):
         app.logger.error(f"Download error: File not found - {safe_filename}")
         return "File not found. It may have been cleaned up or never created.", 404
+
+    if app.config['DOWNLOAD_OFFLOAD'] in ('x-accel', 'x-sendfile'):
+        return offloaded_download_response(file_path, safe_filename, stat_result)
+    # send_file answers conditional and Range requests, and uses the server's sendfile() via
+    # wsgi.file_wrapper where available (e.g. gunicorn) for whole-file responses
+    return send_file(file_path, as_attachment=True, download_name=safe_filename, conditional=True,
+                     etag=artifact_etag(stat_result), last_modified=stat_result.st_mtime)
     # finally block for post-download cleanup was removed for simplicity;
-    # files in 'converted' folder should be managed by a separate cleanup policy/task.
+    # files in 'converted' are expired by the storage janitor (see StorageJanitor).
 
 
 if __name__ == '__main__':
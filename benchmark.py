@@ -0,0 +1,349 @@
+# benchmark.py - Converter benchmark harness for FilePro.in
+#
+# Generates deterministic document fixtures offline (nothing is downloaded), runs every converter and
+# merge function from app.py against them in a fresh process per run, and records wall time, peak RSS
+# and output size. Results can be saved as a baseline and later runs compared against it.
+#
+#   python benchmark.py                          # run the default 'small' + 'medium' sizes
+#   python benchmark.py --sizes small --repeat 5 --save-baseline
+#   python benchmark.py --baseline benchmark_baseline.json --threshold 0.15   # exits 1 on regression
+#
+# Peak RSS comes from resource.getrusage, so it is reported on Unix only.
+import os
+import sys
+import json
+import time
+import queue
+import random
+import argparse
+import platform
+import tempfile
+import statistics
+import multiprocessing
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+DEFAULT_BASELINE_PATH = os.path.join(BASE_DIR, 'benchmark_baseline.json')
+
+# Fixture dimensions per size preset
+SIZES = {
+    'small':  {'pdf_pages': 10,  'pptx_slides': 10,  'image_megapixels': 2,  'docx_paragraphs': 200,   'merge_inputs': 4},
+    'medium': {'pdf_pages': 100, 'pptx_slides': 60,  'image_megapixels': 12, 'docx_paragraphs': 2000,  'merge_inputs': 8},
+    'large':  {'pdf_pages': 500, 'pptx_slides': 300, 'image_megapixels': 48, 'docx_paragraphs': 10000, 'merge_inputs': 16},
+}
+
+WORDS = ("invoice report quarterly revenue summary analysis growth margin forecast customer product "
+         "region total budget variance schedule project milestone review approval contract").split()
+
+
+# --- Fixture Generation ---
+def _sentence(rng, words=12):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+def _noise_image(width, height, seed):
+    # Deterministic "photo-like" content: a noise tile over a gradient, so it doesn't compress to nothing
+    from PIL import Image
+    rng = random.Random(seed)
+    tile = Image.frombytes('RGB', (256, 256), rng.randbytes(256 * 256 * 3))
+    gradient = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    canvas = Image.new('RGB', (width, height))
+    for x in range(0, width, 256):
+        for y in range(0, height, 256):
+            canvas.paste(tile, (x, y))
+    return Image.blend(canvas, gradient, 0.6)
+
+def make_pdf(path, pages, seed=1):
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import A4
+    rng = random.Random(seed)
+    c = canvas.Canvas(path, pagesize=A4, invariant=1) # invariant: no timestamps, byte-identical reruns
+    width, height = A4
+    for page in range(pages):
+        c.setFont("Helvetica-Bold", 16)
+        c.drawString(60, height - 70, f"Section {page + 1}: {_sentence(rng, 4)}")
+        c.setFont("Helvetica", 10)
+        text = c.beginText(60, height - 100)
+        for _ in range(40):
+            text.textLine(_sentence(rng))
+        c.drawText(text)
+        for row in range(6): # A simple table, pdf2docx works hard on these
+            for col in range(4):
+                c.rect(60 + col * 120, 160 - row * 18, 120, 18)
+                c.drawString(64 + col * 120, 165 - row * 18, str(rng.randint(100, 99999)))
+        c.showPage()
+    c.save()
+
+def make_image(path, megapixels, seed=2):
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    image = _noise_image(width, height, seed)
+    if path.endswith('.png'):
+        image.save(path, 'PNG')
+    else:
+        image.save(path, 'JPEG', quality=90)
+
+def make_pptx(path, slides, image_path, seed=3):
+    from pptx import Presentation
+    from pptx.util import Inches
+    rng = random.Random(seed)
+    prs = Presentation()
+    for index in range(slides):
+        slide = prs.slides.add_slide(prs.slide_layouts[5]) # Title only
+        slide.shapes.title.text = f"Slide {index + 1}: {_sentence(rng, 3)}"
+        slide.shapes.add_picture(image_path, Inches(0.5), Inches(1.8), Inches(2), Inches(1.5)) # Same logo on every slide
+        box = slide.shapes.add_textbox(Inches(3), Inches(1.8), Inches(6), Inches(4))
+        for _ in range(5):
+            box.text_frame.add_paragraph().text = _sentence(rng)
+    prs.save(path)
+
+def make_docx(path, paragraphs, seed=4):
+    from docx import Document
+    rng = random.Random(seed)
+    document = Document()
+    for index in range(paragraphs):
+        if index % 50 == 0:
+            document.add_heading(_sentence(rng, 4), level=1)
+        document.add_paragraph(' '.join(_sentence(rng) for _ in range(3)))
+    document.save(path)
+
+def build_fixtures(fixtures_dir, size_name):
+    # Returns {fixture name: path}. Existing files are reused, so repeated runs skip generation.
+    spec = SIZES[size_name]
+    folder = os.path.join(fixtures_dir, size_name)
+    os.makedirs(folder, exist_ok=True)
+    paths = {
+        'pdf': os.path.join(folder, f"doc_{spec['pdf_pages']}p.pdf"),
+        'png': os.path.join(folder, f"scan_{spec['image_megapixels']}mp.png"),
+        'jpg': os.path.join(folder, f"photo_{spec['image_megapixels']}mp.jpg"),
+        'logo': os.path.join(folder, 'logo.png'),
+        'pptx': os.path.join(folder, f"deck_{spec['pptx_slides']}s.pptx"),
+        'docx': os.path.join(folder, f"report_{spec['docx_paragraphs']}para.docx"),
+        'merge_pdf': os.path.join(folder, 'merge_part.pdf'),
+    }
+    builders = {
+        'pdf': lambda p: make_pdf(p, spec['pdf_pages']),
+        'png': lambda p: make_image(p, spec['image_megapixels']),
+        'jpg': lambda p: make_image(p, spec['image_megapixels'], seed=5),
+        'logo': lambda p: make_image(p, 0.3, seed=6),
+        'pptx': lambda p: make_pptx(p, spec['pptx_slides'], paths['logo']),
+        'docx': lambda p: make_docx(p, spec['docx_paragraphs']),
+        'merge_pdf': lambda p: make_pdf(p, max(1, spec['pdf_pages'] // 4), seed=7),
+    }
+    for name, path in paths.items(): # Dict order matters: the logo is built before the deck
+        if not os.path.exists(path):
+            print(f"  generating {os.path.relpath(path, fixtures_dir)}", flush=True)
+            builders[name](path)
+    return paths
+
+
+# --- Benchmark Cases ---
+# name -> (app function, how to call it). Each call gets the fixture paths and a scratch dir and
+# returns (result tuple, output path).
+def _case_pdf_to_docx(app, fx, work, spec):
+    out = os.path.join(work, 'out.docx')
+    return app.convert_pdf_to_docx_robust(fx['pdf'], out), out
+
+def _case_pdf_to_images(app, fx, work, spec):
+    result = app.convert_pdf_to_images_robust(fx['pdf'], os.path.join(work, 'out'), dpi=100)
+    return result[:2], result[2]
+
+def _case_images_to_pdf(app, fx, work, spec):
+    out = os.path.join(work, 'out.pdf')
+    return app.convert_images_to_pdf_robust([fx['png'], fx['jpg']], out), out
+
+def _case_pptx_to_pdf(app, fx, work, spec):
+    out = os.path.join(work, 'out.pdf')
+    return app.convert_pptx_to_pdf_basic(fx['pptx'], out), out
+
+def _case_merge_pdf(app, fx, work, spec):
+    out = os.path.join(work, 'out.pdf')
+    return app.merge_pdf_files_robust([fx['merge_pdf']] * spec['merge_inputs'], out), out
+
+def _case_merge_pdf_incremental(app, fx, work, spec):
+    out = os.path.join(work, 'out.pdf')
+    result = app.merge_pdf_files_incremental([(fx['merge_pdf'], None)] * spec['merge_inputs'], out)
+    return result[:2], out
+
+def _case_merge_docx(app, fx, work, spec):
+    out = os.path.join(work, 'out.docx')
+    return app.merge_docx_files_robust([fx['docx'], fx['docx']], out), out
+
+CASES = {
+    'pdf_to_docx': _case_pdf_to_docx,
+    'pdf_to_images': _case_pdf_to_images,
+    'images_to_pdf': _case_images_to_pdf,
+    'pptx_to_pdf': _case_pptx_to_pdf,
+    'merge_pdf': _case_merge_pdf,
+    'merge_pdf_incremental': _case_merge_pdf_incremental,
+    'merge_docx': _case_merge_docx,
+}
+
+# Backends each case imports on first use (see BACKEND_MODULES in app.py). They're loaded before
+# the clock starts, so the timings measure the conversion and not the one-off import.
+CASE_BACKENDS = {
+    'pdf_to_docx': ('pdf2docx',),
+    'pdf_to_images': ('pdf2image', 'pillow'),
+    'images_to_pdf': ('img2pdf',),
+    'pptx_to_pdf': ('python-pptx', 'reportlab', 'pypdf2'),
+    'merge_pdf': ('pypdf2',),
+    'merge_pdf_incremental': ('pypdf2',),
+    'merge_docx': ('python-docx',),
+}
+
+
+# --- Runner ---
+def _peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def _run_case_in_child(case_name, fixtures, size_name, result_queue):
+    # Runs in a freshly spawned interpreter so peak RSS belongs to this one converter call.
+    work = tempfile.mkdtemp(prefix=f"bench_{case_name}_")
+    try:
+        sys.path.insert(0, BASE_DIR)
+        import app as filepro
+        filepro.app.config['UPLOAD_FOLDER'] = work
+        filepro.app.config['CONVERTED_FOLDER'] = work
+        rss_before = _peak_rss_bytes()
+        filepro.prewarm_backends(','.join(CASE_BACKENDS[case_name]))
+        started = time.perf_counter()
+        (success, message), output_path = CASES[case_name](filepro, fixtures, work, SIZES[size_name])
+        seconds = time.perf_counter() - started
+        output_bytes = os.path.getsize(output_path) if success and output_path and os.path.exists(output_path) else None
+        result_queue.put({'success': success, 'message': message, 'seconds': seconds, 'output_bytes': output_bytes,
+                          'peak_rss_bytes': _peak_rss_bytes(), 'import_rss_bytes': rss_before})
+    except Exception as e:
+        result_queue.put({'success': False, 'message': f"{type(e).__name__}: {e}"})
+    finally:
+        import shutil
+        shutil.rmtree(work, ignore_errors=True)
+
+def _wait_for_result(process, result_queue, timeout):
+    # The child may die without reporting (OOM kill, segfault in a native backend) or hang.
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return result_queue.get(timeout=1)
+        except queue.Empty:
+            pass
+        if not process.is_alive():
+            try:
+                return result_queue.get(timeout=1) # Reported just before exiting
+            except queue.Empty:
+                code = process.exitcode
+                how = f"was killed by signal {-code}" if code < 0 else f"exited with code {code}"
+                return {'success': False, 'message': f"Benchmark process {how} without a result (out of memory?)."}
+        if time.monotonic() > deadline:
+            process.kill()
+            return {'success': False, 'message': f"Timed out after {timeout:.0f}s."}
+
+def run_case(case_name, fixtures, size_name, repeat, timeout):
+    ctx = multiprocessing.get_context('spawn')
+    runs = []
+    for _ in range(repeat):
+        result_queue = ctx.Queue()
+        process = ctx.Process(target=_run_case_in_child, args=(case_name, fixtures, size_name, result_queue))
+        process.start()
+        result = _wait_for_result(process, result_queue, timeout)
+        process.join()
+        if not result['success']:
+            return {'status': 'failed', 'message': result['message']}
+        runs.append(result)
+    times = [run['seconds'] for run in runs]
+    return {
+        'status': 'ok',
+        'seconds_median': round(statistics.median(times), 4),
+        'seconds_min': round(min(times), 4),
+        'peak_rss_bytes': max((run['peak_rss_bytes'] or 0) for run in runs) or None,
+        'import_rss_bytes': runs[0]['import_rss_bytes'],
+        'output_bytes': runs[0]['output_bytes'],
+    }
+
+def compare_to_baseline(results, baseline, threshold):
+    # Returns a list of regression descriptions. Wall time uses the median, memory the peak RSS.
+    regressions = []
+    for key, current in results.items():
+        previous = baseline.get('results', {}).get(key)
+        if not previous or previous.get('status') != 'ok':
+            continue
+        if current.get('status') != 'ok': # Worked in the baseline, fails now
+            regressions.append(f"{key}: ok -> {current.get('status')} ({current.get('message')})")
+            continue
+        for metric in ('seconds_median', 'peak_rss_bytes', 'output_bytes'):
+            old, new = previous.get(metric), current.get(metric)
+            if old and new and new > old * (1 + threshold):
+                regressions.append(f"{key}: {metric} {old} -> {new} (+{(new / old - 1) * 100:.1f}%)")
+    return regressions
+
+def format_table(results, baseline):
+    lines = [f"{'case':<34} {'status':<7} {'median s':>9} {'vs base':>8} {'peak RSS MB':>12} {'output KB':>10}"]
+    for key, r in results.items():
+        if r['status'] != 'ok':
+            lines.append(f"{key:<34} {r['status']:<7} {r['message'][:60]}")
+            continue
+        previous = baseline.get('results', {}).get(key, {}) if baseline else {}
+        delta = ''
+        if previous.get('seconds_median'):
+            delta = f"{(r['seconds_median'] / previous['seconds_median'] - 1) * 100:+.1f}%"
+        rss = f"{r['peak_rss_bytes'] / 1e6:.1f}" if r['peak_rss_bytes'] else 'n/a'
+        out = f"{r['output_bytes'] / 1024:.1f}" if r['output_bytes'] else 'n/a'
+        lines.append(f"{key:<34} {'ok':<7} {r['seconds_median']:>9.3f} {delta:>8} {rss:>12} {out:>10}")
+    return '\n'.join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark FilePro.in converters on generated fixtures.")
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=['small', 'medium'])
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per case; the median wall time is reported.")
+    parser.add_argument('--timeout', type=float, default=1800, help="Seconds before a single run is killed and counted as failed.")
+    parser.add_argument('--fixtures-dir', default=os.path.join(tempfile.gettempdir(), 'filepro_bench_fixtures'))
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_PATH, help="Baseline JSON to compare against.")
+    parser.add_argument('--save-baseline', action='store_true', help="Write this run's results to --baseline.")
+    parser.add_argument('--threshold', type=float, default=0.15, help="Allowed slowdown/growth before failing, e.g. 0.15 = 15%%.")
+    parser.add_argument('--json', dest='json_output', help="Also write the raw results to this JSON file.")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for size_name in args.sizes:
+        print(f"[{size_name}] preparing fixtures in {args.fixtures_dir}", flush=True)
+        fixtures = build_fixtures(args.fixtures_dir, size_name)
+        for case_name in args.cases:
+            key = f"{case_name}/{size_name}"
+            print(f"  running {key}", flush=True)
+            results[key] = run_case(case_name, fixtures, size_name, max(1, args.repeat), args.timeout)
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    print()
+    print(format_table(results, baseline))
+
+    report = {'created_at': time.time(), 'python': platform.python_version(), 'machine': platform.machine(),
+              'cpu_count': os.cpu_count(), 'results': results}
+    if args.json_output:
+        with open(args.json_output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    if baseline:
+        regressions = compare_to_baseline(results, baseline, args.threshold)
+        if regressions:
+            print(f"\nRegressions (failures, or growth beyond {args.threshold * 100:.0f}%):")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"\nNo regressions beyond {args.threshold * 100:.0f}% against {args.baseline}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -41,7 +41,7 @@ document.addEventListener('DOMContentLoaded', function () {
             case 'pdf': return '<i class="bi bi-file-earmark-pdf-fill text-danger"></i>';
             case 'doc': case 'docx': return '<i class="bi bi-file-earmark-word-fill text-primary"></i>';
             case 'ppt': case 'pptx': return '<i class="bi bi-file-earmark-slides-fill text-warning"></i>'; // text-orange might be bootstrap 5
-            case 'jpg': case 'jpeg': case 'png': case 'gif': return '<i class="bi bi-file-earmark-image-fill text-success"></i>';
+            case 'jpg': case 'jpeg': case 'png': case 'gif': case 'webp': return '<i class="bi bi-file-earmark-image-fill text-success"></i>';
             default: return '<i class="bi bi-file-earmark-fill text-secondary"></i>';
         }
     }
@@ -54,15 +54,69 @@ document.addEventListener('DOMContentLoaded', function () {
             const listItem = document.createElement('li');
             listItem.innerHTML = `${getFileIcon(getFileExtension(file.name))} ${file.name} (${(file.size / 1024).toFixed(1)} KB) <span class="remove-file" data-filename="${file.name}" title="Remove file">×</span>`;
             fileListElement.appendChild(listItem);
+            addPdfPreview(listItem, file);
         } else if (!isSingleFileMode) {
             filesArray.forEach(file => {
                 const listItem = document.createElement('li');
                 listItem.innerHTML = `${getFileIcon(getFileExtension(file.name))} ${file.name} (${(file.size / 1024).toFixed(1)} KB) <span class="remove-file" data-filename="${file.name}" title="Remove file">×</span>`;
                 fileListElement.appendChild(listItem);
+                addPdfPreview(listItem, file);
             });
         }
     }
 
+    // --- Page Previews (PDF thumbnails) ---
+    const PREVIEW_THUMBNAILS = 6;
+    const previewDocuments = new WeakMap(); // File -> Promise of its server-side preview document (or null)
+
+    async function sha256Hex(file) {
+        const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+        return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+    }
+
+    function getPreviewDocument(file) {
+        if (!previewDocuments.has(file)) {
+            previewDocuments.set(file, (async () => {
+                if (file.size > CHUNKED_UPLOAD_THRESHOLD) return null; // Not worth an extra large upload just for thumbnails
+                // Previews are keyed by content hash, so a PDF the server already has needs no upload
+                if (window.crypto && crypto.subtle) {
+                    const known = await readJsonResponse(await fetch(`/preview/${await sha256Hex(file)}`));
+                    if (known.ok) return known.body.document;
+                }
+                const formData = new FormData();
+                formData.append('file_to_preview', file);
+                const created = await readJsonResponse(await fetch('/preview', { method: 'POST', body: formData }));
+                return created.ok ? created.body.document : null;
+            })().catch(() => null)); // Previews are optional, never block converting or merging
+        }
+        return previewDocuments.get(file);
+    }
+
+    async function addPdfPreview(listItem, file) {
+        if (getFileExtension(file.name) !== 'pdf') return;
+        const container = document.createElement('div');
+        container.className = 'page-previews';
+        listItem.appendChild(container);
+        const previewDocument = await getPreviewDocument(file);
+        if (!previewDocument) return;
+        const shown = Math.min(previewDocument.page_count, PREVIEW_THUMBNAILS);
+        for (let page = 1; page <= shown; page++) {
+            const img = document.createElement('img');
+            img.src = previewDocument.page_url_template.replace('{page}', page); // Immutable URLs, the browser caches them
+            img.alt = `Page ${page}`;
+            img.title = `Page ${page}`;
+            img.loading = 'lazy';
+            img.className = 'page-thumbnail';
+            container.appendChild(img);
+        }
+        if (previewDocument.page_count > shown) {
+            const more = document.createElement('span');
+            more.className = 'page-previews-more';
+            more.textContent = `+${previewDocument.page_count - shown} more page(s)`;
+            container.appendChild(more);
+        }
+    }
+
     // --- Converter Specific Logic ---
     const convertDropArea = document.getElementById('dropArea');
     const convertFileInputActual = document.getElementById('convertFileInputActual');
@@ -88,9 +142,10 @@ document.addEventListener('DOMContentLoaded', function () {
         'pptx': [
             { value: 'pdf', text: 'PDF (Basic Presentation Slides)' }
         ],
-        'jpg':  [{ value: 'pdf', text: 'PDF (Image in Document)' }, { value: 'png', text: 'PNG Image' }],
-        'jpeg': [{ value: 'pdf', text: 'PDF (Image in Document)' }, { value: 'png', text: 'PNG Image' }], // Alias for jpg
-        'png':  [{ value: 'pdf', text: 'PDF (Image in Document)' }, { value: 'jpg', text: 'JPEG Image' }]
+        'jpg':  [{ value: 'pdf', text: 'PDF (Image in Document)' }, { value: 'png', text: 'PNG Image' }, { value: 'webp', text: 'WebP Image' }],
+        'jpeg': [{ value: 'pdf', text: 'PDF (Image in Document)' }, { value: 'png', text: 'PNG Image' }, { value: 'webp', text: 'WebP Image' }], // Alias for jpg
+        'png':  [{ value: 'pdf', text: 'PDF (Image in Document)' }, { value: 'jpg', text: 'JPEG Image' }, { value: 'webp', text: 'WebP Image' }],
+        'webp': [{ value: 'pdf', text: 'PDF (Image in Document)' }, { value: 'jpg', text: 'JPEG Image' }, { value: 'png', text: 'PNG Image' }]
     };
     convertOptionsMap['jpeg'] = convertOptionsMap['jpg']; // Ensure alias
 
@@ -152,7 +207,13 @@ document.addEventListener('DOMContentLoaded', function () {
     const mergeProgressBar = document.getElementById('mergeProgressBar');
     const mergeStatusMessage = document.getElementById('mergeStatusMessage');
     const mergeDownloadLinkContainer = document.getElementById('mergeDownloadLinkContainer');
-    const allowedMergeTypes = ['pdf', 'docx']; // Keep this updated with backend
+    const allowedMergeTypes = ['pdf', 'docx', 'images']; // Keep this updated with backend
+    const imageExtensions = ['jpg', 'jpeg', 'png', 'webp']; // Merged into one PDF, any mix of these
+
+    function getMergeType(fileName) {
+        const ext = getFileExtension(fileName);
+        return imageExtensions.includes(ext) ? 'images' : ext;
+    }
 
     function updateMergeButtonStateAndType() {
         if (!mergeButton || !mergeTypeInput) return;
@@ -160,14 +221,14 @@ document.addEventListener('DOMContentLoaded', function () {
         let allSameType = true;
 
         if (uploadedMergeFiles.length > 0) {
-            firstFileType = getFileExtension(uploadedMergeFiles[0].name);
+            firstFileType = getMergeType(uploadedMergeFiles[0].name);
             if (!allowedMergeTypes.includes(firstFileType)) {
                 allSameType = false; // Mark as invalid type for merging
                  if (mergeStatusMessage) mergeStatusMessage.textContent = `Merging .${firstFileType} files is not supported.`;
                  if (mergeStatusArea) mergeStatusArea.style.display = 'block';
             } else {
                 for (let i = 1; i < uploadedMergeFiles.length; i++) {
-                    if (getFileExtension(uploadedMergeFiles[i].name) !== firstFileType) {
+                    if (getMergeType(uploadedMergeFiles[i].name) !== firstFileType) {
                         allSameType = false;
                         break;
                     }
@@ -180,7 +241,7 @@ document.addEventListener('DOMContentLoaded', function () {
         mergeTypeInput.value = enableButton ? firstFileType : '';
 
         if (uploadedMergeFiles.length > 0 && !allSameType && allowedMergeTypes.includes(firstFileType)) {
-            if (mergeStatusMessage) mergeStatusMessage.textContent = 'All files must be of the same supported type (e.g., all PDFs or all DOCXs).';
+            if (mergeStatusMessage) mergeStatusMessage.textContent = 'All files must be of the same supported type (e.g., all PDFs, all DOCXs or all images).';
             if (mergeStatusArea) mergeStatusArea.style.display = 'block';
         } else if (enableButton && mergeStatusMessage && mergeStatusArea && mergeStatusArea.style.display === 'block' && (mergeStatusMessage.textContent.includes('All files must be') || mergeStatusMessage.textContent.includes('not supported'))) {
             resetMergeStatus(); // Clear error if now valid
@@ -250,9 +311,57 @@ document.addEventListener('DOMContentLoaded', function () {
         e.stopPropagation();
     }
 
+    // --- Chunked Uploads (large files) ---
+    const CHUNKED_UPLOAD_THRESHOLD = 16 * 1024 * 1024; // Keep below the server's per-request MAX_CONTENT_LENGTH
+    const UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024;
+    const MAX_CHUNK_RETRIES = 3;
+
+    async function readJsonResponse(res) {
+        const body = await res.json().catch(() => ({}));
+        return { ok: res.ok, status: res.status, body };
+    }
+
+    async function uploadInChunks(file, initUrl, onProgress) {
+        const init = await readJsonResponse(await fetch(initUrl, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ filename: file.name, total_size: file.size })
+        }));
+        if (!init.ok || !init.body.upload) throw new Error(init.body.error || 'Could not start the upload.');
+        const upload = init.body.upload;
+
+        let offset = 0;
+        let retries = 0;
+        while (offset < file.size) {
+            try {
+                const res = await readJsonResponse(await fetch(`${upload.chunk_url}?offset=${offset}`, {
+                    method: 'PUT',
+                    headers: { 'Content-Type': 'application/octet-stream' },
+                    body: file.slice(offset, offset + UPLOAD_CHUNK_SIZE)
+                }));
+                // A 409 carries the server's byte count too, so we just resume from there
+                if (!res.body.upload) throw new Error(res.body.error || `Chunk upload failed (Status: ${res.status}).`);
+                if (!res.ok && res.status !== 409) throw new Error(res.body.error);
+                offset = res.body.upload.received;
+                retries = 0;
+            } catch (chunkError) {
+                if (++retries > MAX_CHUNK_RETRIES) throw chunkError;
+                // Connection dropped mid-chunk: ask the server how much it kept and resume from there
+                const status = await readJsonResponse(await fetch(upload.chunk_url));
+                if (!status.body.upload) throw chunkError;
+                offset = status.body.upload.received;
+            }
+            onProgress(offset);
+        }
+
+        const done = await readJsonResponse(await fetch(`${upload.chunk_url}/finalize`, { method: 'POST' }));
+        if (!done.ok) throw new Error(done.body.error || 'Could not finalize the upload.');
+        return upload.upload_id;
+    }
+
     // --- Form Submission with AJAX & Progress ---
     function submitFormWithProgress(formElement, statusArea, progressBarElem, statusMessageElem, downloadContainer, successUiCallback) {
-        formElement.addEventListener('submit', function (e) {
+        formElement.addEventListener('submit', async function (e) {
             e.preventDefault();
             const formData = new FormData(); // Create fresh FormData
             const actionUrl = formElement.dataset.actionUrl;
@@ -265,17 +374,22 @@ document.addEventListener('DOMContentLoaded', function () {
                 return;
             }
             
-            // Append files from our JS managed arrays
+            // Collect files from our JS managed arrays; they're appended below, directly or as chunked upload ids
+            let filesToSend = [];
+            let fileFieldName = '';
+            let uploadIdFieldName = '';
             if (formElement.id === 'convertForm' && uploadedConvertFile) {
-                formData.append('file_to_convert', uploadedConvertFile, uploadedConvertFile.name);
+                filesToSend = [uploadedConvertFile];
+                fileFieldName = 'file_to_convert';
+                uploadIdFieldName = 'upload_id';
                 // Append other form fields from the form
                 const targetFormat = formElement.querySelector('[name="target_format"]');
                 if(targetFormat) formData.append('target_format', targetFormat.value);
 
             } else if (formElement.id === 'mergeForm' && uploadedMergeFiles.length > 0) {
-                uploadedMergeFiles.forEach(file => {
-                    formData.append('files_to_merge', file, file.name); // Changed name to files_to_merge as per Flask
-                });
+                filesToSend = uploadedMergeFiles.slice();
+                fileFieldName = 'files_to_merge'; // Changed name to files_to_merge as per Flask
+                uploadIdFieldName = 'upload_ids';
                 const mergeType = formElement.querySelector('[name="merge_type"]');
                  if(mergeType) formData.append('merge_type', mergeType.value);
             } else {
@@ -286,6 +400,8 @@ document.addEventListener('DOMContentLoaded', function () {
             }
 
 
+            formData.append('async', '1'); // Server queues the work and returns a job id to poll
+
             statusArea.style.display = 'block';
             progressBarElem.style.width = '0%';
             progressBarElem.textContent = '0%';
@@ -294,19 +410,44 @@ document.addEventListener('DOMContentLoaded', function () {
             statusMessageElem.className = 'status-message text-info'; // Reset class
             downloadContainer.innerHTML = '';
 
+            const showUploadProgress = (fraction) => {
+                const percentComplete = Math.round(fraction * 100);
+                progressBarElem.style.width = percentComplete + '%';
+                progressBarElem.textContent = percentComplete + '%';
+                if (percentComplete < 100) {
+                    statusMessageElem.textContent = `Uploading... ${percentComplete}%`;
+                } else {
+                     statusMessageElem.textContent = 'Upload complete. Processing on server...';
+                }
+            };
+
+            // Big files go through the chunked upload API first, the form then only carries their upload ids
+            if (filesToSend.some(file => file.size > CHUNKED_UPLOAD_THRESHOLD)) {
+                const totalBytes = filesToSend.reduce((sum, file) => sum + file.size, 0);
+                let doneBytes = 0;
+                try {
+                    for (const file of filesToSend) {
+                        const uploadId = await uploadInChunks(file, formElement.dataset.uploadUrl,
+                            (sentBytes) => showUploadProgress((doneBytes + sentBytes) / totalBytes));
+                        doneBytes += file.size;
+                        formData.append(uploadIdFieldName, uploadId);
+                    }
+                } catch (uploadError) {
+                    if (progressBarElem.parentElement) progressBarElem.parentElement.style.display = 'none';
+                    statusMessageElem.textContent = uploadError.message || 'Upload failed. Please try again.';
+                    statusMessageElem.className = 'status-message text-danger';
+                    return;
+                }
+            } else {
+                filesToSend.forEach(file => formData.append(fileFieldName, file, file.name));
+            }
+
             const xhr = new XMLHttpRequest();
             xhr.open('POST', actionUrl, true);
 
             xhr.upload.onprogress = function (event) {
-                if (event.lengthComputable) {
-                    const percentComplete = Math.round((event.loaded / event.total) * 100);
-                    progressBarElem.style.width = percentComplete + '%';
-                    progressBarElem.textContent = percentComplete + '%';
-                    if (percentComplete < 100) {
-                        statusMessageElem.textContent = `Uploading... ${percentComplete}%`;
-                    } else {
-                         statusMessageElem.textContent = 'Upload complete. Processing on server...';
-                    }
+                if (event.lengthComputable && !formData.has(uploadIdFieldName)) {
+                    showUploadProgress(event.loaded / event.total);
                 }
             };
 
@@ -323,18 +464,11 @@ document.addEventListener('DOMContentLoaded', function () {
                     return;
                 }
 
-                if (xhr.status >= 200 && xhr.status < 300 && response.success) {
-                    statusMessageElem.textContent = response.message || 'Processing successful!';
-                    statusMessageElem.className = 'status-message text-success';
-                    if (response.download_url) {
-                        const downloadLink = document.createElement('a');
-                        downloadLink.href = response.download_url;
-                        downloadLink.textContent = `Download ${response.filename || 'Processed File'}`;
-                        downloadLink.className = 'btn btn-success mt-2';
-                        downloadLink.setAttribute('download', response.filename || '');
-                        downloadContainer.appendChild(downloadLink);
-                    }
-                    if(successUiCallback) successUiCallback();
+                if (xhr.status === 202 && response.success && response.status_url) {
+                    statusMessageElem.textContent = response.message || 'Queued...';
+                    pollJobStatus(response.status_url, progressBarElem, statusMessageElem, downloadContainer, successUiCallback);
+                } else if (xhr.status >= 200 && xhr.status < 300 && response.success) {
+                    showProcessedResult(response, statusMessageElem, downloadContainer, successUiCallback);
                 } else {
                     statusMessageElem.textContent = response.error || `An error occurred (Status: ${xhr.status}).`;
                     statusMessageElem.className = 'status-message text-danger';
@@ -350,6 +484,56 @@ document.addEventListener('DOMContentLoaded', function () {
         });
     }
 
+    function showProcessedResult(result, statusMessageElem, downloadContainer, successUiCallback) {
+        statusMessageElem.textContent = result.message || 'Processing successful!';
+        statusMessageElem.className = 'status-message text-success';
+        if (result.download_url) {
+            const downloadLink = document.createElement('a');
+            downloadLink.href = result.download_url;
+            downloadLink.textContent = `Download ${result.filename || 'Processed File'}`;
+            downloadLink.className = 'btn btn-success mt-2';
+            downloadLink.setAttribute('download', result.filename || '');
+            downloadContainer.appendChild(downloadLink);
+        }
+        if(successUiCallback) successUiCallback();
+    }
+
+    // --- Background Job Polling ---
+    function pollJobStatus(statusUrl, progressBarElem, statusMessageElem, downloadContainer, successUiCallback) {
+        if (progressBarElem.parentElement) progressBarElem.parentElement.style.display = 'flex';
+        const poll = () => {
+            fetch(statusUrl, { headers: { 'Accept': 'application/json' } })
+                .then(res => res.json().then(body => ({ ok: res.ok, body })))
+                .then(({ ok, body }) => {
+                    const job = body.job;
+                    if (!ok || !job) {
+                        throw new Error(body.error || 'Lost track of the job.');
+                    }
+                    const percent = Math.round((job.progress || 0) * 100);
+                    progressBarElem.style.width = percent + '%';
+                    progressBarElem.textContent = percent + '%';
+                    if (job.status === 'queued' || job.status === 'running') {
+                        statusMessageElem.textContent = job.message || 'Processing on server...';
+                        setTimeout(poll, 1000);
+                        return;
+                    }
+                    if (progressBarElem.parentElement) progressBarElem.parentElement.style.display = 'none';
+                    if (job.status === 'finished') {
+                        showProcessedResult(job, statusMessageElem, downloadContainer, successUiCallback);
+                    } else {
+                        statusMessageElem.textContent = job.error || `Processing ${job.status}.`;
+                        statusMessageElem.className = 'status-message text-danger';
+                    }
+                })
+                .catch(err => {
+                    if (progressBarElem.parentElement) progressBarElem.parentElement.style.display = 'none';
+                    statusMessageElem.textContent = err.message || 'Network error occurred while checking progress.';
+                    statusMessageElem.className = 'status-message text-danger';
+                });
+        };
+        setTimeout(poll, 500);
+    }
+
     const convertForm = document.getElementById('convertForm');
     if (convertForm) {
         submitFormWithProgress(
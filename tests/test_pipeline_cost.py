@@ -0,0 +1,54 @@
+import pytest
+from pptx import Presentation
+
+import app as filepro
+
+
+@pytest.fixture
+def deck(tmp_path):
+    def make(slide_count, name='deck.pptx'):
+        prs = Presentation()
+        for _ in range(slide_count):
+            prs.slides.add_slide(prs.slide_layouts[6])
+        path = tmp_path / name
+        prs.save(path)
+        return {'path': str(path), 'ext': 'pptx', 'name': name}
+    return make
+
+
+def pipeline_cost(items, steps):
+    return filepro.estimate_pipeline_cost(items, filepro.plan_pipeline([item['ext'] for item in items], steps))
+
+
+def render_cpu(pages, dpi):
+    return pages * filepro.COST_PDF_RENDER_PAGE_CPU * (dpi / filepro.DEFAULT_RENDER_DPI) ** 2
+
+
+def test_later_steps_are_priced_on_the_converted_document(deck):
+    items = [deck(20)]
+    to_pdf_cpu, to_pdf_memory = pipeline_cost(items, [{'op': 'convert', 'to': 'pdf'}])
+    cpu, memory = pipeline_cost(items, [{'op': 'convert', 'to': 'pdf'}, {'op': 'convert', 'to': 'images', 'dpi': 600}])
+    assert cpu == pytest.approx(to_pdf_cpu + filepro.COST_BASE[0] + render_cpu(20, 600))
+    assert memory > to_pdf_memory # 600-DPI rasters of 10x7.5in slides
+
+
+def test_merged_page_count_and_page_ranges_carry_forward(deck):
+    items = [deck(10, 'a.pptx'), deck(30, 'b.pptx')]
+    steps = [{'op': 'convert', 'to': 'pdf'}, {'op': 'merge'}]
+    merged_cpu, _ = pipeline_cost(items, steps)
+    cpu, _ = pipeline_cost(items, steps + [{'op': 'convert', 'to': 'images', 'dpi': 100}])
+    assert cpu == pytest.approx(merged_cpu + filepro.COST_BASE[0] + render_cpu(40, 100))
+
+    steps[1]['page_ranges'] = ['1-2', None]
+    ranged_cpu, _ = pipeline_cost(items, steps)
+    cpu, _ = pipeline_cost(items, steps + [{'op': 'convert', 'to': 'images', 'dpi': 100}])
+    assert cpu == pytest.approx(ranged_cpu + filepro.COST_BASE[0] + render_cpu(32, 100))
+
+
+def test_unreadable_intermediates_fall_back_to_size(tmp_path):
+    path = tmp_path / 'broken.pptx'
+    path.write_bytes(b'x' * 1024 * 1024)
+    items = [{'path': str(path), 'ext': 'pptx', 'name': 'broken.pptx'}]
+    cpu, _ = pipeline_cost(items, [{'op': 'convert', 'to': 'pdf'}, {'op': 'convert', 'to': 'images'}])
+    size_cpu = filepro.COST_BASE[0] + filepro.COST_FALLBACK_PER_MB[0]
+    assert cpu == pytest.approx(filepro.COST_BASE[0] + 2 * size_cpu)